@@ -0,0 +1,34 @@
+"""
+Микробенчмарк кодека callback_data.
+
+Запуск из корня проекта: python -m benchmarks.callback_codec_bench
+Корректность (round-trip, мусорные и обрезанные строки, длина) проверяют
+тесты: python -m pytest tests/test_callback_codec.py
+"""
+import timeit
+
+from bson import ObjectId
+
+from utils import callback_codec
+
+NUMBER = 20000
+
+
+def bench(title: str, func, number: int = NUMBER):
+    seconds = timeit.timeit(func, number=number)
+    print(f"{title:<45} {seconds / number * 1e6:10.2f} мкс/вызов")
+
+
+def main():
+    event_id = ObjectId()
+    rate = callback_codec.encode("rate", event_id, 123456789, 5)
+    print(f"rate: {len(rate)} байт вместо {len(f'rate_{event_id}_123456789_5')}")
+
+    bench("encode rate", lambda: callback_codec.encode("rate", event_id, 123456789, 5))
+    bench("decode rate (кэш)", lambda: callback_codec.decode(rate))
+    bench("decode rate (без кэша)", lambda: callback_codec.decode.__wrapped__(rate))
+    bench("split('_') старого формата", lambda: f"rate_{event_id}_123456789_5".split("_"))
+
+
+if __name__ == "__main__":
+    main()
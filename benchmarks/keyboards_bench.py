@@ -0,0 +1,38 @@
+"""
+Микробенчмарк построения клавиатур.
+
+Запуск из корня проекта: python -m benchmarks.keyboards_bench
+Сравнивает готовые (закэшированные) клавиатуры с построением с нуля.
+"""
+import timeit
+from datetime import date
+
+from keyboards import builder
+from keyboards.builder import KeyboardBuilder
+
+NUMBER = 2000
+
+
+def bench(title: str, func, number: int = NUMBER):
+    seconds = timeit.timeit(func, number=number)
+    print(f"{title:<45} {seconds / number * 1e6:10.2f} мкс/вызов")
+
+
+def main():
+    today = date.today()
+    KeyboardBuilder.warm_calendar_cache(3)
+
+    bench("main_menu (готовая)", KeyboardBuilder.main_menu)
+    bench("main_menu (построение)", builder._build_main_menu)
+    bench("build_time_keyboard (готовая)", KeyboardBuilder.build_time_keyboard)
+    bench("build_time_keyboard (построение)", builder._build_time_keyboard)
+    bench("build_game_choice_keyboard (готовая)", KeyboardBuilder.build_game_choice_keyboard)
+    bench("build_game_choice_keyboard (построение)", builder._build_game_choice_keyboard)
+    bench("build_calendar (кэш)", lambda: KeyboardBuilder.build_calendar(today.year, today.month))
+    bench("build_calendar (построение)",
+          lambda: builder._build_calendar.__wrapped__(today.year, today.month, today, ""))
+    print(f"Кэш календарей: {builder._build_calendar.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Стоимость сброса состояния MongoPersistence.
+
+Запуск из корня проекта: python -m benchmarks.persistence_bench [--write]
+Помечает USERS пользователей и их диалоги измененными и замеряет подготовку одного
+bulk_write (сериализация + операции). С --write пачка действительно записывается
+в коллекцию bot_state базы из MONGO_URI и затем удаляется.
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from database import bot_state_collection, close_db
+from database.persistence import MongoPersistence
+
+USERS = 10000
+
+
+def typical_user_data(user_id: int) -> dict:
+    now = datetime.utcnow()
+    data = {"events_filter": (now, now + timedelta(days=7))}
+    if user_id % 10 == 0:  # Часть пользователей в середине редактирования
+        data["edit_event_id"] = str(ObjectId())
+        data["edit_datetime_date"] = "2026-10-17"
+    return data
+
+
+async def main(write: bool):
+    persistence = MongoPersistence(update_interval=3600)
+    base_id = 10 ** 9
+    for user_id in range(base_id, base_id + USERS):
+        await persistence.update_user_data(user_id, typical_user_data(user_id))
+        await persistence.update_conversation("event_edit_conversation", (user_id, user_id), 1)
+
+    dirty, persistence._dirty = persistence._dirty, {}
+    started = time.perf_counter()
+    operations = persistence.build_operations(dirty, datetime.utcnow())
+    elapsed = time.perf_counter() - started
+    stats = persistence.stats()
+    print(f"{len(operations)} операций за {elapsed * 1000:.1f} мс, "
+          f"{stats['bytes_written'] / len(operations):.0f} байт данных на документ")
+
+    if write:
+        started = time.perf_counter()
+        await bot_state_collection.bulk_write(operations, ordered=False)
+        print(f"bulk_write: {(time.perf_counter() - started) * 1000:.1f} мс")
+        await bot_state_collection.delete_many({"_id": {"$in": list(dirty)}})
+        close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main("--write" in sys.argv))
@@ -0,0 +1,83 @@
+"""
+Микробенчмарк поиска обработчика callback-запроса.
+
+Запуск из корня проекта: python -m benchmarks.router_bench
+Сравнивает цепочку регулярных выражений (как CallbackQueryHandler'ы проверялись по порядку
+до маршрутизатора) с поиском по словарю в CallbackRouter.
+"""
+import re
+import timeit
+
+from bson import ObjectId
+
+from utils import callback_codec
+from utils.router import CallbackRouter, route_key
+
+NUMBER = 20000
+
+
+def _noop():
+    pass
+
+
+# Цепочка CallbackQueryHandler'ов до маршрутизатора и кодека: строковые callback_data
+# и регулярные выражения, как в исходных handlers/start.py и handlers/events.py
+# (join_\w+, info_\w+, ...). Для кнопок, появившихся позже, - паттерны того же вида.
+CHAIN = [
+    re.compile(r"^start_command$").match,
+    re.compile(r"rate_event_\w+_\d+").match,
+    re.compile(r"^filter_\w+$").match,
+    re.compile(r"^range_(day|month)_\w+$").match,
+    re.compile(r"^page_\w+$").match,
+    re.compile(r"^my_events_(past|upcoming)$").match,
+    re.compile(r"join_\w+").match,
+    re.compile(r"info_\w+").match,
+    re.compile(r"^leave_\w+$").match,
+    re.compile(r"^cancel_event_\w+$").match,
+    re.compile(r"^confirm_cancel_event_\w+$").match,
+    re.compile(r"^do_not_cancel_event$").match,
+]
+
+
+def chain_lookup(data: str):
+    for index, pattern in enumerate(CHAIN):
+        if pattern(data):
+            return index
+    return None
+
+
+def build_router() -> CallbackRouter:
+    router = CallbackRouter()
+    for key in ("start_command", "rate", "range_day", "range_month", "page", "my_events_past",
+                "my_events_upcoming", "join", "info", "leave", "cancel_event", "confirm_cancel",
+                "do_not_cancel_event"):
+        router.add(key, _noop)
+    router.add_prefix("filter", _noop)
+    return router
+
+
+def bench(title: str, func, number: int = NUMBER):
+    seconds = timeit.timeit(func, number=number)
+    print(f"{title:<45} {seconds / number * 1e6:10.2f} мкс/вызов")
+
+
+def main():
+    router = build_router()
+    event_id = ObjectId()
+    # Имя -> (прежняя строковая callback_data, callback_data маршрутизатора)
+    samples = {
+        "start_command": ("start_command", "start_command"),
+        "info": (f"info_{event_id}", callback_codec.encode("info", event_id)),
+        "confirm_cancel": (f"confirm_cancel_event_{event_id}", callback_codec.encode("confirm_cancel", event_id)),
+        "do_not_cancel_event": ("do_not_cancel_event", "do_not_cancel_event"),
+    }
+
+    for name, (old_data, data) in samples.items():
+        bench(f"цепочка паттернов: {name}", lambda: chain_lookup(old_data))
+        bench(f"маршрутизатор: {name}", lambda: router.resolve(data))
+        bench(f"маршрутизатор без кэша: {name}",
+              lambda: (route_key.cache_clear(), callback_codec.decode.cache_clear(), router.resolve(data)))
+
+
+if __name__ == "__main__":
+    main()
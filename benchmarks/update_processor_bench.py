@@ -0,0 +1,76 @@
+"""
+Нагрузочный тест обработки обновлений.
+
+Запуск из корня проекта: python -m benchmarks.update_processor_bench
+Смешанный трафик: быстрые обработчики (кнопки) и редкие медленные (большие списки,
+рассылки). Сравнивает последовательную обработку (лимит 1) с PerChatUpdateProcessor
+при разных лимитах и проверяет, что обновления одного пользователя не перемешались.
+"""
+import asyncio
+import random
+import time
+
+from utils.update_processor import PerChatUpdateProcessor
+
+USERS = 200
+UPDATES_PER_USER = 10
+FAST_SECONDS = 0.002
+SLOW_SECONDS = 0.1
+SLOW_SHARE = 0.05
+
+
+class BenchProcessor(PerChatUpdateProcessor):
+    @staticmethod
+    def chat_key(update):
+        return update["user_id"]
+
+
+async def handle(update: dict, seen: dict):
+    # Проверка порядка: номер обновления пользователя должен расти без пропусков
+    expected = seen.get(update["user_id"], -1) + 1
+    assert update["seq"] == expected, f"порядок нарушен у пользователя {update['user_id']}"
+    seen[update["user_id"]] = update["seq"]
+    await asyncio.sleep(update["cost"])
+
+
+async def run(limit: int, updates: list) -> float:
+    processor = BenchProcessor(limit)
+    seen = {}
+    gauge = []
+
+    async def sample():
+        while True:
+            gauge.append(processor.stats()["pending"])
+            await asyncio.sleep(0.01)
+
+    sampler = asyncio.create_task(sample())
+    started = time.perf_counter()
+    # Как Application: по задаче на обновление в порядке поступления
+    await asyncio.gather(*(processor.process_update(update, handle(update, seen)) for update in updates))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+
+    assert all(seen[user_id] == UPDATES_PER_USER - 1 for user_id in range(USERS))
+    print(f"лимит {limit:>4}: {len(updates) / elapsed:10.1f} обновлений/с, "
+          f"{elapsed:6.2f} с, макс. очередь {max(gauge, default=0)}, {processor.stats()}")
+    return elapsed
+
+
+def make_updates() -> list:
+    random.seed(1)
+    updates = []
+    for seq in range(UPDATES_PER_USER):
+        for user_id in random.sample(range(USERS), USERS):
+            cost = SLOW_SECONDS if random.random() < SLOW_SHARE else FAST_SECONDS
+            updates.append({"user_id": user_id, "seq": seq, "cost": cost})
+    return updates
+
+
+def main():
+    updates = make_updates()
+    for limit in (1, 8, 32, 128):
+        asyncio.run(run(limit, updates))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,98 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def _int_list(value: str):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
 class Config:
     # ИСПРАВЛЕНИЕ ЗДЕСЬ: Измените TOKEN на TELEGRAM_TOKEN
     TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
     MONGO_URI = os.getenv("MONGO_URI")
-    DB_NAME = "game_planner"
\ No newline at end of file
+    DB_NAME = "game_planner"
+
+    # Пул соединений MongoDB
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "20"))
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+    MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+    # Сжатие трафика: zlib встроен, для snappy/zstd нужны дополнительные пакеты
+    MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")
+
+    # За сколько минут до начала события отправлять напоминания (по умолчанию 24ч, 1ч и 15мин).
+    # Для отдельного события можно задать поле 'reminder_offsets' со своим списком.
+    REMINDER_OFFSETS = _int_list(os.getenv("REMINDER_OFFSETS", "1440,60,15"))
+    # Повторы напоминания участникам, которым оно не ушло из-за ошибки Telegram: число попыток и пауза (с)
+    REMINDER_SEND_ATTEMPTS = int(os.getenv("REMINDER_SEND_ATTEMPTS", "3"))
+    REMINDER_RETRY_DELAY = float(os.getenv("REMINDER_RETRY_DELAY", "30"))
+
+    # Исходящие запросы (utils.outbound): глобальный лимит Telegram ~30 сообщений/с,
+    # фоновые сообщения в один чат — не чаще 1 в секунду, повторы после RetryAfter
+    OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "25"))
+    OUTBOUND_PER_CHAT_INTERVAL = float(os.getenv("OUTBOUND_PER_CHAT_INTERVAL", "1"))
+    OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+    # Рассылки: сколько сообщений держать в очереди отправки одновременно и размер пачки получателей
+    BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+    BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "100"))
+    # Сколько дней хранить записи о завершенных рассылках
+    BROADCAST_RETENTION_DAYS = int(os.getenv("BROADCAST_RETENTION_DAYS", "7"))
+
+    # Длительность события по умолчанию (в часах), если создатель ее не указал
+    DEFAULT_EVENT_DURATION_HOURS = int(os.getenv("DEFAULT_EVENT_DURATION_HOURS", "2"))
+
+    # Сколько событий показывать в одном списке
+    EVENTS_PAGE_SIZE = int(os.getenv("EVENTS_PAGE_SIZE", "10"))
+
+    # Кэш событий для EventCRUD.get (LRU + TTL)
+    EVENT_CACHE_ENABLED = os.getenv("EVENT_CACHE_ENABLED", "1") == "1"
+    EVENT_CACHE_SIZE = int(os.getenv("EVENT_CACHE_SIZE", "1000"))
+    EVENT_CACHE_TTL = float(os.getenv("EVENT_CACHE_TTL", "30"))
+
+    # Сколько игроков показывать в /top
+    TOP_LIMIT = int(os.getenv("TOP_LIMIT", "10"))
+    # Сколько недель хранить недельные корзины оценок (для топов по играм и периодам)
+    RATING_BUCKET_RETENTION_WEEKS = int(os.getenv("RATING_BUCKET_RETENTION_WEEKS", "26"))
+
+    # Буфер записи оценок: интервал сброса (в секундах) и размер, при котором сброс происходит сразу
+    RATING_FLUSH_INTERVAL = float(os.getenv("RATING_FLUSH_INTERVAL", "2"))
+    RATING_BUFFER_MAX_SIZE = int(os.getenv("RATING_BUFFER_MAX_SIZE", "500"))
+
+    # На сколько месяцев вперед строить календари при старте
+    CALENDAR_PREFETCH_MONTHS = int(os.getenv("CALENDAR_PREFETCH_MONTHS", "3"))
+
+    # Режим работы: "polling" (getUpdates) или "webhook" (HTTP-сервер, например web-dyno из Procfile)
+    RUN_MODE = os.getenv("RUN_MODE", "polling")
+    # Публичный адрес сервера без пути, например https://example.herokuapp.com.
+    # Если не задан, вебхук в Telegram не регистрируется (удобно для локальной проверки).
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+    # Секрет, который Telegram передает в заголовке X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+    WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    PORT = int(os.getenv("PORT", "8443"))
+
+    # Сколько обновлений обрабатывать одновременно (обновления одного чата все равно идут по очереди)
+    MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+
+    # Хранение состояния диалогов и user_data между перезапусками: "mongo", "file" или "none"
+    PERSISTENCE_BACKEND = os.getenv("PERSISTENCE_BACKEND", "mongo")
+    PERSISTENCE_FILE = os.getenv("PERSISTENCE_FILE", "bot_state.pickle")
+    # Как часто (в секундах) накопленные изменения сбрасываются в хранилище
+    PERSISTENCE_FLUSH_INTERVAL = float(os.getenv("PERSISTENCE_FLUSH_INTERVAL", "30"))
+    # Сколько дней хранить user_data неактивного пользователя
+    PERSISTENCE_USER_DATA_TTL_DAYS = int(os.getenv("PERSISTENCE_USER_DATA_TTL_DAYS", "30"))
+    # Через сколько часов брошенный диалог (создание/редактирование события) сбрасывается
+    CONVERSATION_TIMEOUT_HOURS = float(os.getenv("CONVERSATION_TIMEOUT_HOURS", "24"))
+
+    # Как часто (в секундах) записывать накопленные профили и last_seen пользователей
+    ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "15"))
+
+    # Сводка новых событий для пользователей в режиме "дайджест": раз в сколько часов
+    # и сколько событий максимум в одном сообщении
+    DIGEST_INTERVAL_HOURS = float(os.getenv("DIGEST_INTERVAL_HOURS", "6"))
+    DIGEST_MAX_EVENTS = int(os.getenv("DIGEST_MAX_EVENTS", "10"))
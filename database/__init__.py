@@ -1,9 +1,66 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from config import Config
 
-client = AsyncIOMotorClient(Config.MONGO_URI)
-db = client[Config.DB_NAME]
+# Единственный клиент MongoDB на все приложение. Создается лениво при первом обращении
+# (или явно в init_db из post_init), а не при импорте модулей.
+_client = None
 
-events_collection = db.events
-users_collection = db.users
-ratings_collection = db.ratings
+
+def get_client() -> AsyncIOMotorClient:
+    global _client
+    if _client is None:
+        options = {
+            "maxPoolSize": Config.MONGO_MAX_POOL_SIZE,
+            "minPoolSize": Config.MONGO_MIN_POOL_SIZE,
+            "maxIdleTimeMS": Config.MONGO_MAX_IDLE_TIME_MS,
+            "serverSelectionTimeoutMS": Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            "connectTimeoutMS": Config.MONGO_CONNECT_TIMEOUT_MS,
+            "socketTimeoutMS": Config.MONGO_SOCKET_TIMEOUT_MS,
+        }
+        if Config.MONGO_COMPRESSORS:
+            options["compressors"] = Config.MONGO_COMPRESSORS
+        _client = AsyncIOMotorClient(Config.MONGO_URI, **options)
+    return _client
+
+
+def get_db():
+    return get_client()[Config.DB_NAME]
+
+
+async def init_db():
+    """
+    Создает пул соединений и проверяет доступность сервера. Вызывается из post_init.
+    """
+    await get_client().admin.command("ping")
+
+
+def close_db():
+    """
+    Закрывает пул соединений. Вызывается при остановке бота.
+    """
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+class LazyCollection:
+    """
+    Ссылка на коллекцию, которая обращается к клиенту только при использовании.
+    Позволяет объявлять коллекции на уровне модуля без подключения к базе при импорте.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, item):
+        return getattr(get_db()[self._name], item)
+
+
+events_collection = LazyCollection("events")
+users_collection = LazyCollection("users")
+ratings_collection = LazyCollection("ratings")
+broadcasts_collection = LazyCollection("broadcasts")
+creator_stats_collection = LazyCollection("creator_stats")
+rating_buckets_collection = LazyCollection("rating_buckets")
+bot_state_collection = LazyCollection("bot_state")
@@ -1,16 +1,180 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
+import time
+from collections import OrderedDict
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from config import Config
-from datetime import datetime
+from datetime import datetime, timedelta
 
-# Инициализация клиента MongoDB
-client = AsyncIOMotorClient(Config.MONGO_URI)
-db = client[Config.DB_NAME]
+# Коллекции берутся из общего клиента (см. database/__init__.py)
+from database import (
+    events_collection,
+    users_collection,
+    ratings_collection,
+    broadcasts_collection,
+    creator_stats_collection,
+    rating_buckets_collection,
+    bot_state_collection,
+)
 
-# Объявление коллекций
-events_collection = db.events
-users_collection = db.users
-ratings_collection = db.ratings
+
+async def ensure_indexes():
+    """
+    Создает индексы, необходимые для запросов бота. Вызывается при старте.
+    """
+    # Сортировка и keyset-пагинация списков событий
+    await events_collection.create_index([("datetime", 1), ("_id", 1)])
+    # Списки "мои события": ветки $or по создателю и участнику отдаются уже отсортированными
+    await events_collection.create_index([("creator_id", 1), ("datetime", 1), ("_id", 1)])
+    await events_collection.create_index([("participants", 1), ("datetime", 1), ("_id", 1)])
+    # Поиск завершившихся событий, по которым еще не запрошена оценка
+    await events_collection.create_index([("ends_at", 1), ("rating_requested", 1)])
+    # Таблица лидеров
+    await creator_stats_collection.create_index([("average", -1), ("count", -1)])
+    # Корзины оценок по (создатель, игра, неделя) и их автоматическое удаление
+    await rating_buckets_collection.create_index(
+        [("creator_id", 1), ("game", 1), ("week_start", 1)],
+        unique=True
+    )
+    await rating_buckets_collection.create_index([("week_start", 1), ("game", 1)])
+    await rating_buckets_collection.create_index("expires_at", expireAfterSeconds=0)
+    # Одна оценка от участника создателю за событие
+    await ratings_collection.create_index(
+        [("event_id", 1), ("creator_id", 1), ("rater_id", 1)],
+        unique=True
+    )
+    # Получатели рассылок без заблокировавших бота
+    await users_collection.create_index([("inactive", 1), ("_id", 1)])
+    # Получатели уведомлений о новых событиях: подписчики игры по возрастанию _id
+    await users_collection.create_index([("subscriptions", 1), ("inactive", 1), ("_id", 1)])
+    # Получатели сводок, у которых подошло время следующей
+    await users_collection.create_index([("notify_mode", 1), ("digest_sent_at", 1)])
+    # Состояние диалогов и user_data (database.persistence): загрузка по виду и удаление брошенного
+    await bot_state_collection.create_index([("kind", 1), ("name", 1)])
+    await bot_state_collection.create_index("expires_at", expireAfterSeconds=0)
+    # Возобновление незавершенных рассылок при старте и удаление завершенных
+    await broadcasts_collection.create_index("finished")
+    await broadcasts_collection.create_index("expires_at", expireAfterSeconds=0)
+
+
+# Пользователи, которым можно отправлять сообщения. None - документы без поля inactive
+# (до миграции); $in по точкам позволяет отдавать их отсортированными по _id прямо из индекса.
+ACTIVE_USERS = {"inactive": {"$in": [False, None]}}
+
+# Режимы уведомлений о новых событиях: сразу по каждому событию или сводкой раз в DIGEST_INTERVAL_HOURS
+NOTIFY_INSTANT = "instant"
+NOTIFY_DIGEST = "digest"
+
+
+def to_datetime(value):
+    """
+    Приводит дату события к datetime. Строки вида "YYYY-MM-DD HH:MM" (старый формат
+    и значения из обработчиков) преобразуются здесь, на границе слоя работы с БД.
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _event_end(start, duration_hours):
+    """
+    Вычисляет время окончания события по дате начала и длительности.
+    """
+    start = to_datetime(start)
+    if start is None:
+        return None
+    return start + timedelta(hours=duration_hours or Config.DEFAULT_EVENT_DURATION_HOURS)
+
+
+class EventCache:
+    """
+    Асинхронный LRU+TTL кэш событий по ObjectId для EventCRUD.get.
+
+    Одновременные промахи по одному ключу объединяются: в базу уходит один запрос,
+    остальные ждут его результат. Все изменяющие методы EventCRUD обновляют
+    или сбрасывают запись (put/invalidate), и незавершенная загрузка того же ключа
+    после этого в кэш не попадает. Возвращаемые документы общие - изменять их нельзя.
+    """
+
+    def __init__(self, max_size: int, ttl: float, enabled: bool = True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries = OrderedDict()  # ObjectId -> (expires_at, event)
+        self._inflight = {}  # ObjectId -> Future с результатом загрузки
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: ObjectId, loader):
+        if not self.enabled:
+            return await loader()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+
+        self.misses += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            event = await loader()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # Помечаем исключение как полученное, если ожидающих нет
+            raise
+        finally:
+            # Если запись сбросили во время загрузки, результат уже мог устареть
+            is_current = self._inflight.get(key) is future
+            if is_current:
+                del self._inflight[key]
+
+        if is_current and event is not None:
+            self.put(event)
+        future.set_result(event)
+        return event
+
+    def put(self, event: dict):
+        if not self.enabled or event is None:
+            return
+        key = event["_id"]
+        # Загрузка, начатая до изменения, вернет старый документ: ее результат не кэшируем
+        self._inflight.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, event)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: ObjectId):
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+event_cache = EventCache(Config.EVENT_CACHE_SIZE, Config.EVENT_CACHE_TTL, Config.EVENT_CACHE_ENABLED)
 
 
 class UserCRUD:
@@ -19,10 +183,11 @@ class UserCRUD:
         """
         Добавляет пользователя в коллекцию, если его там нет,
         или обновляет поле 'last_seen' для существующего пользователя.
+        Пользователь снова пишет боту, поэтому отметка inactive снимается.
         """
         await users_collection.update_one(
             {"_id": user_id},
-            {"$set": {"last_seen": datetime.utcnow()}},
+            {"$set": {"last_seen": datetime.utcnow(), "inactive": False}},
             upsert=True  # Если документа нет, он будет создан
         )
 
@@ -38,103 +203,442 @@ class UserCRUD:
         """
         Возвращает список всех user_id из коллекции 'users'.
         """
-        cursor = users_collection.find({}, {"_id": 1})
+        cursor = users_collection.find(ACTIVE_USERS, {"_id": 1})
         return [user["_id"] async for user in cursor]
 
+    @staticmethod
+    async def iter_user_ids(after: int = None, batch_size: int = 500, game: str = None,
+                            exclude_digest: bool = False):
+        """
+        Потоково отдает user_id по возрастанию, начиная после указанного ID.
+        Список пользователей целиком в память не загружается. Пользователи,
+        заблокировавшие бота (inactive), пропускаются по индексу (inactive, _id).
+        Если указана игра, отдаются только ее подписчики (индекс (subscriptions, inactive, _id)).
+        exclude_digest - пропустить тех, кто получает новые события сводкой.
+        """
+        query = dict(ACTIVE_USERS)
+        if game is not None:
+            query["subscriptions"] = game
+        if exclude_digest:
+            query["notify_mode"] = {"$ne": NOTIFY_DIGEST}
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        cursor = users_collection.find(query, {"_id": 1}).sort("_id", 1).batch_size(batch_size)
+        async for user in cursor:
+            yield user["_id"]
+
+    @staticmethod
+    async def get_notification_settings(user_id: int) -> dict:
+        """
+        Возвращает настройки уведомлений пользователя: {"subscriptions", "notify_mode"}.
+        """
+        user = await users_collection.find_one({"_id": user_id}, {"subscriptions": 1, "notify_mode": 1})
+        user = user or {}
+        return {
+            "subscriptions": user.get("subscriptions", []),
+            "notify_mode": user.get("notify_mode", NOTIFY_INSTANT),
+        }
+
+    @staticmethod
+    async def toggle_subscription(user_id: int, game: str) -> dict:
+        """
+        Подписывает пользователя на игру или отписывает, если подписка уже есть.
+        Переключение выполняется одним атомарным обновлением.
+        Возвращает новые настройки уведомлений (как get_notification_settings).
+        """
+        current = {"$ifNull": ["$subscriptions", []]}
+        user = await users_collection.find_one_and_update(
+            {"_id": user_id},
+            [{"$set": {"subscriptions": {"$cond": [
+                {"$in": [game, current]},
+                {"$filter": {"input": current, "cond": {"$ne": ["$$this", game]}}},
+                {"$concatArrays": [current, [game]]},
+            ]}}}],
+            projection={"subscriptions": 1, "notify_mode": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return {
+            "subscriptions": user.get("subscriptions", []),
+            "notify_mode": user.get("notify_mode", NOTIFY_INSTANT),
+        }
+
+    @staticmethod
+    async def set_notify_mode(user_id: int, mode: str):
+        """
+        Переключает режим уведомлений. Отсчет следующей сводки начинается с момента переключения.
+        """
+        await users_collection.update_one(
+            {"_id": user_id},
+            {"$set": {"notify_mode": mode, "digest_sent_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    @staticmethod
+    def iter_digest_due(due_before: datetime, batch_size: int = 500):
+        """
+        Курсор по активным пользователям в режиме сводки, которым последняя сводка
+        отправлена не позже due_before. Индекс (notify_mode, digest_sent_at).
+        """
+        query = dict(ACTIVE_USERS)
+        query.update(notify_mode=NOTIFY_DIGEST, digest_sent_at={"$lte": due_before})
+        return users_collection.find(
+            query, {"subscriptions": 1, "digest_sent_at": 1}
+        ).batch_size(batch_size)
+
+    @staticmethod
+    async def mark_digest_sent(user_ids: list, sent_at: datetime):
+        """
+        Отмечает время сводки для пачки пользователей одним запросом.
+        """
+        if user_ids:
+            await users_collection.update_many(
+                {"_id": {"$in": user_ids}},
+                {"$set": {"digest_sent_at": sent_at}}
+            )
+
+    @staticmethod
+    async def mark_inactive(user_id: int):
+        """
+        Отмечает пользователя, до которого нельзя доставить сообщение
+        (бот заблокирован, чат не найден). Рассылки его пропускают до следующего /start.
+        """
+        await users_collection.update_one(
+            {"_id": user_id},
+            {"$set": {"inactive": True, "inactive_since": datetime.utcnow()}}
+        )
+
+    @staticmethod
+    async def apply_activity(batch: dict):
+        """
+        Записывает накопленные профили и время активности пользователей
+        (utils.activity.ActivityTracker) одним неупорядоченным bulk_write.
+        Обновляются только уже зарегистрированные (/start) пользователи, новые документы не создаются.
+        batch: {user_id: {"username", "first_name", "last_seen", ...}}.
+        """
+        if not batch:
+            return
+        await users_collection.bulk_write(
+            [UpdateOne({"_id": user_id}, {"$set": fields}) for user_id, fields in batch.items()],
+            ordered=False
+        )
+
+    @staticmethod
+    async def filter_active(user_ids: list) -> list:
+        """
+        Убирает из списка (например, участников события) пользователей с отметкой inactive.
+        """
+        if not user_ids:
+            return []
+        cursor = users_collection.find({"_id": {"$in": user_ids}, "inactive": True}, {"_id": 1})
+        inactive = {user["_id"] async for user in cursor}
+        return [user_id for user_id in user_ids if user_id not in inactive]
+
 
 class EventCRUD:
+    # Подписчики на изменения событий (например, планировщик напоминаний).
+    # Каждый подписчик реализует on_event_saved(event) и on_event_deleted(event_id).
+    listeners = []
+
+    @staticmethod
+    def cache_stats() -> dict:
+        """
+        Счетчики кэша событий: размер, попадания, промахи, вытеснения.
+        """
+        return event_cache.stats()
+
+    @staticmethod
+    def add_listener(listener):
+        """
+        Регистрирует подписчика на создание, изменение и удаление событий.
+        """
+        EventCRUD.listeners.append(listener)
+
+    @staticmethod
+    def _notify_saved(event: dict):
+        for listener in EventCRUD.listeners:
+            listener.on_event_saved(event)
+
+    @staticmethod
+    def _notify_deleted(event_id: str):
+        for listener in EventCRUD.listeners:
+            listener.on_event_deleted(event_id)
+
     @staticmethod
     async def create(data: dict):
         """
         Создает новое событие в базе данных.
-        """
-        result = await events_collection.insert_one(data)
+        Время окончания (ends_at) сохраняется сразу, чтобы по нему можно было искать по индексу.
+        """
+        event = dict(data)  # insert_one добавляет _id в документ, не трогаем исходный словарь
+        event["datetime"] = to_datetime(event.get("datetime"))
+        event.setdefault("duration", Config.DEFAULT_EVENT_DURATION_HOURS)
+        event["ends_at"] = _event_end(event.get("datetime"), event["duration"])
+        event["participants_count"] = len(event.get("participants", []))
+        result = await events_collection.insert_one(event)
+        event_cache.put(event)
+        EventCRUD._notify_saved(event)
         return str(result.inserted_id)
 
     @staticmethod
     async def get(event_id: str):
         """
-        Возвращает событие по его ID.
+        Возвращает событие по его ID (через кэш event_cache).
         """
-        return await events_collection.find_one({"_id": ObjectId(event_id)})
+        object_id = ObjectId(event_id)
+        return await event_cache.get(object_id, lambda: events_collection.find_one({"_id": object_id}))
+
+    @staticmethod
+    def card_projection(user_id: int = None) -> dict:
+        """
+        Компактная проекция "карточки" события для списков.
+        Вместо массива participants сервер возвращает participants_count и, если передан
+        user_id, флаг is_member - участвует ли пользователь в событии.
+        """
+        participants = {"$ifNull": ["$participants", []]}
+        projection = {
+            "game": 1,
+            "description": 1,
+            "datetime": 1,
+            "creator_id": 1,
+            "creator_name": 1,
+            "participant_limit": 1,
+            "participants_count": {"$size": participants},
+        }
+        if user_id is not None:
+            projection["is_member"] = {"$in": [user_id, participants]}
+        return projection
 
     @staticmethod
-    async def list_all():
+    async def list_all(projection: dict = None):
         """
         Возвращает список всех событий, отсортированных по дате.
         """
-        cursor = events_collection.find().sort("datetime")
+        cursor = events_collection.find({}, projection).sort("datetime")
         return [event async for event in cursor]
 
     @staticmethod
-    async def filter_by_date(start, end):
+    async def page(query: dict, cursor: tuple = None, direction: str = "next", limit: int = None,
+                   projection: dict = None, descending: bool = False):
+        """
+        Keyset-пагинация по (datetime, _id): страница берется прямо из индекса, без skip.
+        cursor - (datetime, _id) крайнего события предыдущей страницы, direction - "next" или "prev".
+        projection - необязательная проекция (например, card_projection).
+        descending - сначала поздние события (индекс читается в обратном направлении).
+        Возвращает (events, has_prev, has_next), события отсортированы по дате.
+        """
+        limit = limit or Config.EVENTS_PAGE_SIZE
+        forward = direction != "prev"
+        ascending = forward != descending
+        order = 1 if ascending else -1
+
+        if cursor is not None:
+            dt, last_id = cursor
+            op = "$gt" if ascending else "$lt"
+            keyset = {"$or": [{"datetime": {op: dt}}, {"datetime": dt, "_id": {op: last_id}}]}
+            query = {"$and": [query, keyset]}
+
+        docs = events_collection.find(query, projection).sort([("datetime", order), ("_id", order)]).limit(limit + 1)
+        events = [event async for event in docs]
+        has_more = len(events) > limit
+        events = events[:limit]
+        if forward:
+            return events, cursor is not None, has_more
+        events.reverse()
+        return events, has_more, True
+
+    @staticmethod
+    async def filter_by_date(start, end=None, cursor: tuple = None, direction: str = "next", limit: int = None,
+                             projection: dict = None):
         """
-        Возвращает список событий в заданном диапазоне дат.
+        Возвращает страницу предстоящих событий в заданном диапазоне дат (end=None - без верхней границы).
+        Прошедшие события отсекаются на стороне базы, запрос идет по индексу (datetime, _id).
         """
-        cursor = events_collection.find({"datetime": {"$gte": start.isoformat(), "$lte": end.isoformat()}}).sort(
-            "datetime")
-        return [event async for event in cursor]
+        date_range = {"$gte": max(start, datetime.utcnow())}
+        if end is not None:
+            date_range["$lte"] = end
+        return await EventCRUD.page({"datetime": date_range}, cursor, direction, limit, projection)
 
     @staticmethod
-    async def list_active_exclude_user(user_id: int):
+    async def list_active_exclude_user(user_id: int, cursor: tuple = None, direction: str = "next",
+                                       limit: int = None, projection: dict = None):
         """
-        Возвращает список активных событий (которые еще не прошли) других пользователей.
+        Возвращает страницу активных событий (которые еще не прошли) других пользователей.
         """
-        now = datetime.utcnow().isoformat()
-        cursor = events_collection.find({
+        now = datetime.utcnow()
+        query = {
             "creator_id": {"$ne": user_id},
             "datetime": {"$gte": now}
-        }).sort("datetime")
-        return [event async for event in cursor]
+        }
+        return await EventCRUD.page(query, cursor, direction, limit, projection)
+
+    @staticmethod
+    async def list_user_events(user_id: int, cursor: tuple = None, direction: str = "next", limit: int = None,
+                               projection: dict = None, when: str = None):
+        """
+        Возвращает страницу событий, которые пользователь создал или в которых участвует.
+        Один запрос с $or (каждая ветка идет по своему индексу с сортировкой по дате),
+        роль пользователя ("creator" или "participant") вычисляется в проекции поля role.
+        when: "upcoming" - только предстоящие, "past" - только прошедшие (сначала недавние), None - все.
+        """
+        query = {"$or": [{"creator_id": user_id}, {"participants": user_id}]}
+        if when == "upcoming":
+            query["datetime"] = {"$gte": datetime.utcnow()}
+        elif when == "past":
+            query["datetime"] = {"$lt": datetime.utcnow()}
+
+        projection = dict(projection or EventCRUD.card_projection(user_id))
+        projection["role"] = {"$cond": [{"$eq": ["$creator_id", user_id]}, "creator", "participant"]}
+        return await EventCRUD.page(query, cursor, direction, limit, projection, descending=when == "past")
+
+    @staticmethod
+    async def list_created_since(since: datetime, projection: dict = None) -> list:
+        """
+        Возвращает предстоящие события, созданные (EventCRUD.create) после указанного момента,
+        по дате начала. Время создания берется из ObjectId, поэтому запрос идет по индексу _id.
+        """
+        query = {
+            "_id": {"$gt": ObjectId.from_datetime(since)},
+            "datetime": {"$gte": datetime.utcnow()}
+        }
+        cursor = events_collection.find(query, projection or EventCRUD.card_projection()).sort("datetime", 1)
+        return await cursor.to_list(None)
+
+    @staticmethod
+    def iter_upcoming(since: datetime):
+        """
+        Возвращает курсор по событиям, которые начнутся после указанного момента.
+        Загружаются только поля, нужные для расчета напоминаний.
+        """
+        return events_collection.find(
+            {"datetime": {"$gt": since}},
+            {"datetime": 1, "reminder_offsets": 1, "reminders_sent": 1}
+        )
+
+    @staticmethod
+    async def mark_reminders_sent(event_id: str, offsets: list):
+        """
+        Отмечает, что напоминания с указанными смещениями (в минутах) уже отправлены
+        или пропущены и повторно отправляться не должны.
+        """
+        await events_collection.update_one(
+            {"_id": ObjectId(event_id)},
+            {"$addToSet": {"reminders_sent": {"$each": list(offsets)}}}
+        )
+        event_cache.invalidate(ObjectId(event_id))
+
+    @staticmethod
+    def iter_ended_for_rating(since: datetime, until: datetime):
+        """
+        Возвращает курсор по событиям, завершившимся в указанном интервале,
+        по которым еще не запрашивали оценку. Использует индекс (ends_at, rating_requested).
+        """
+        return events_collection.find(
+            {"ends_at": {"$gte": since, "$lte": until}, "rating_requested": {"$ne": True}},
+            {"game": 1, "participants": 1, "creator_id": 1, "creator_name": 1}
+        )
+
+    @staticmethod
+    async def mark_rating_requested(event_ids: list):
+        """
+        Одним bulk_write помечает события как "оценка запрошена".
+        """
+        if not event_ids:
+            return
+        await events_collection.bulk_write(
+            [UpdateOne({"_id": event_id}, {"$set": {"rating_requested": True}}) for event_id in event_ids],
+            ordered=False
+        )
+        for event_id in event_ids:
+            event_cache.invalidate(event_id)
 
     @staticmethod
-    async def list_by_creator(creator_id: int):
+    async def list_by_creator(creator_id: int, projection: dict = None):
         """
         Возвращает список всех событий, созданных определенным пользователем.
         """
-        cursor = events_collection.find({"creator_id": creator_id}).sort("datetime")
+        cursor = events_collection.find({"creator_id": creator_id}, projection).sort("datetime")
         return [event async for event in cursor]
 
     @staticmethod
-    async def list_participated_by_user(user_id: int):
+    async def list_participated_by_user(user_id: int, projection: dict = None):
         """
         Возвращает список всех событий, в которых участвует данный пользователь.
         """
-        cursor = events_collection.find({"participants": user_id}).sort("datetime")
+        cursor = events_collection.find({"participants": user_id}, projection).sort("datetime")
         return [event async for event in cursor]
 
     @staticmethod
     async def add_participant(event_id: str, user_id: int):
         """
-        Добавляет участника к событию.
+        Атомарно добавляет участника к событию одним запросом.
+        Условие проверяется в самой базе: пользователь не создатель, еще не участвует
+        и в событии есть свободные места (по полю participants_count). Поэтому при
+        одновременных нажатиях лимит участников не может быть превышен.
+        Возвращает обновленное событие или None, если присоединиться нельзя.
         """
-        await events_collection.update_one(
-            {"_id": ObjectId(event_id)},
-            {"$addToSet": {"participants": user_id}}
+        event = await events_collection.find_one_and_update(
+            {
+                "_id": ObjectId(event_id),
+                "creator_id": {"$ne": user_id},
+                "participants": {"$ne": user_id},
+                "$or": [
+                    {"participant_limit": {"$not": {"$gt": 0}}},  # 0 или нет поля - без лимита
+                    {"$expr": {"$lt": ["$participants_count", "$participant_limit"]}}
+                ]
+            },
+            {"$push": {"participants": user_id}, "$inc": {"participants_count": 1}},
+            return_document=ReturnDocument.AFTER
         )
-        return await events_collection.find_one({"_id": ObjectId(event_id)})
+        event_cache.put(event)
+        return event
 
     @staticmethod
     async def remove_participant(event_id: str, user_id: int):
         """
-        Удаляет участника из события.
+        Атомарно удаляет участника из события (создатель покинуть событие не может).
+        Возвращает обновленное событие или None, если пользователь не участвовал.
         """
-        await events_collection.update_one(
-            {"_id": ObjectId(event_id)},
-            {"$pull": {"participants": user_id}}
+        event = await events_collection.find_one_and_update(
+            {"_id": ObjectId(event_id), "participants": user_id, "creator_id": {"$ne": user_id}},
+            {"$pull": {"participants": user_id}, "$inc": {"participants_count": -1}},
+            return_document=ReturnDocument.AFTER
         )
-        return await events_collection.find_one({"_id": ObjectId(event_id)})
+        event_cache.put(event)
+        return event
 
     @staticmethod
     async def update_event(event_id: str, data: dict):
         """
         Обновляет поля события по его ID.
         """
-        result = await events_collection.update_one(
+        data = dict(data)
+        if "datetime" in data:
+            data["datetime"] = to_datetime(data["datetime"])
+        if "datetime" in data or "duration" in data:
+            # Пересчитываем сохраненное время окончания
+            current = await events_collection.find_one({"_id": ObjectId(event_id)}, {"datetime": 1, "duration": 1})
+            if current is None:
+                return False
+            data["ends_at"] = _event_end(
+                data.get("datetime", current.get("datetime")),
+                data.get("duration", current.get("duration"))
+            )
+
+        update = {"$set": data}
+        if "datetime" in data:
+            # После переноса события напоминания нужно отправить заново
+            update["$unset"] = {"reminders_sent": ""}
+        event = await events_collection.find_one_and_update(
             {"_id": ObjectId(event_id)},
-            {"$set": data}
+            update,
+            return_document=ReturnDocument.AFTER
         )
-        return result.modified_count > 0
+        if event is None:
+            return False
+        event_cache.put(event)
+        EventCRUD._notify_saved(event)
+        return True
 
     @staticmethod
     async def delete_event(event_id: str):
@@ -142,68 +646,326 @@ class EventCRUD:
         Удаляет событие по его ID.
         """
         result = await events_collection.delete_one({"_id": ObjectId(event_id)})
+        event_cache.invalidate(ObjectId(event_id))
+        if result.deleted_count > 0:
+            EventCRUD._notify_deleted(str(event_id))  # ID может прийти как ObjectId из callback_data
         return result.deleted_count > 0
 
 
+def week_start(moment: datetime) -> datetime:
+    """
+    Начало ISO-недели (понедельник 00:00) для указанного момента.
+    """
+    day = datetime(moment.year, moment.month, moment.day)
+    return day - timedelta(days=day.weekday())
+
+
+class RatingWriteBuffer:
+    """
+    Буфер записи оценок. После завершения популярного события оценки приходят пачкой,
+    поэтому они копятся в памяти (последняя оценка по ключу побеждает) и раз в
+    RATING_FLUSH_INTERVAL секунд записываются вместе со статистикой.
+
+    Разница со старой оценкой берется из документа, который вернула сама запись
+    (RatingCRUD._write_ratings), поэтому она верна и при нескольких экземплярах бота.
+    Разница считается один раз, когда оценка записана: неотправленные приращения
+    статистики хранятся отдельно и повторяются сами, без повторного сравнения оценок.
+    """
+
+    def __init__(self, interval: float, max_size: int):
+        self.interval = interval
+        self.max_size = max_size
+        self._pending = {}  # (event_id, creator_id, rater_id) -> {"rating", "game", "timestamp"}
+        self._creator_deltas = {}  # creator_id -> (sum, count), еще не записанные в creator_stats
+        self._bucket_deltas = {}  # (creator_id, game, week_start) -> (sum, count) для rating_buckets
+        self._lock = asyncio.Lock()
+        self._full = asyncio.Event()
+        self._task = None
+
+    def add(self, event_id: ObjectId, creator_id: int, rater_id: int, rating: int, game: str):
+        self._pending[(event_id, creator_id, rater_id)] = {
+            "rating": rating,
+            "game": game,
+            "timestamp": datetime.utcnow()
+        }
+        if len(self._pending) >= self.max_size:
+            self._full.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            task, self._task = self._task, None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                # Отмена при остановке не прерывает начатую запись: иначе записанные оценки
+                # вернулись бы в буфер без своей разницы. stop() дождется ее на блокировке.
+                await asyncio.shield(self.flush())
+            except Exception as e:
+                print(f"Ошибка при записи оценок: {e}")
+
+    async def flush(self):
+        async with self._lock:
+            if self._pending:
+                batch, self._pending = self._pending, {}
+                try:
+                    changes, failed = await RatingCRUD._write_ratings(batch)
+                except BaseException:
+                    # Повторная запись уже записанной оценки даст нулевую разницу
+                    self._requeue(batch, batch)
+                    raise
+                # Разницу записанных оценок учитываем, незаписанные возвращаем в буфер
+                self._add_deltas(changes)
+                self._requeue(batch, failed)
+                if failed:
+                    print(f"Ошибка при записи оценок ({len(failed)}): {next(iter(failed.values()))}")
+
+            # Каждая коллекция очищает только то, что в нее действительно записалось
+            self._creator_deltas = await RatingCRUD._write_deltas(
+                creator_stats_collection, self._creator_deltas, RatingCRUD._creator_stats_op
+            )
+            self._bucket_deltas = await RatingCRUD._write_deltas(
+                rating_buckets_collection, self._bucket_deltas, RatingCRUD._bucket_op
+            )
+
+    def _requeue(self, batch: dict, keys):
+        # Не перезаписываем оценки, пришедшие во время сброса
+        for key in keys:
+            self._pending.setdefault(key, batch[key])
+
+    def _add_deltas(self, changes: list):
+        for creator_id, bucket, sum_delta, count_delta in changes:
+            for deltas, delta_key in ((self._creator_deltas, creator_id), (self._bucket_deltas, bucket)):
+                current = deltas.get(delta_key, (0, 0))
+                deltas[delta_key] = (current[0] + sum_delta, current[1] + count_delta)
+
+
 class RatingCRUD:
     @staticmethod
-    async def add_rating(event_id: str, creator_id: int, rater_id: int, rating: int):
+    async def add_rating(event_id: str, creator_id: int, rater_id: int, rating: int, game: str = None):
         """
         Добавляет или обновляет оценку, данную одним пользователем другому
-        за конкретное событие.
+        за конкретное событие. Оценка попадает в буфер rating_buffer и записывается
+        вместе с остальными при ближайшем сбросе.
         """
-        await ratings_collection.update_one(
+        if game is None:
+            event = await EventCRUD.get(event_id)
+            game = event.get("game", "Другое") if event else "Другое"
+        rating_buffer.add(ObjectId(event_id), creator_id, rater_id, rating, game)
+
+    @staticmethod
+    async def _write_ratings(batch: dict) -> tuple:
+        """
+        Записывает пачку оценок и возвращает (changes, failed): изменения статистики
+        создателей [(creator_id, (creator_id, game, week_start), sum_delta, count_delta)]
+        и ошибки незаписанных оценок {ключ: исключение}. Оценки пишутся параллельно.
+        """
+        keys = list(batch)
+        results = await asyncio.gather(
+            *(RatingCRUD._write_rating(key, batch[key]) for key in keys), return_exceptions=True
+        )
+        changes, failed = [], {}
+        for key, result in zip(keys, results):
+            if isinstance(result, BaseException):
+                failed[key] = result
+            elif result is not None:
+                changes.append(result)
+        return changes, failed
+
+    @staticmethod
+    async def _write_rating(key: tuple, value: dict):
+        """
+        Записывает одну оценку через find_one_and_update с upsert и возвращает изменение
+        статистики (None, если оценка не изменилась). Запрос возвращает документ до записи,
+        поэтому разница считается по тому значению, которое перезаписала именно эта запись:
+        два экземпляра бота, записавшие одну оценку, не учтут одно изменение дважды.
+        При перезаписи игра и неделя берутся из первой оценки, чтобы изменение попало
+        в ту же корзину.
+        """
+        event_id, creator_id, rater_id = key
+        rating, game, timestamp = value["rating"], value["game"], value["timestamp"]
+        old = await ratings_collection.find_one_and_update(
+            {"event_id": event_id, "creator_id": creator_id, "rater_id": rater_id},
             {
-                "event_id": ObjectId(event_id),
-                "creator_id": creator_id,
-                "rater_id": rater_id
+                "$set": {"rating": rating, "timestamp": timestamp},
+                "$setOnInsert": {"game": game, "week_start": week_start(timestamp)}
             },
-            {"$set": {"rating": rating, "timestamp": datetime.utcnow()}},
+            projection={"_id": 0, "rating": 1, "game": 1, "week_start": 1, "timestamp": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        if old is None or old.get("rating") is None:
+            return creator_id, (creator_id, game, week_start(timestamp)), rating, 1
+        if old["rating"] == rating:
+            return None
+        bucket_week = old.get("week_start") or week_start(old.get("timestamp") or timestamp)
+        return creator_id, (creator_id, old.get("game", game), bucket_week), rating - old["rating"], 0
+
+    @staticmethod
+    async def _write_deltas(collection, deltas: dict, make_op) -> dict:
+        """
+        Записывает приращения статистики одним bulk_write. Возвращает те, что не записались
+        (при ошибке - все, кроме подтвержденных), чтобы повторить их при следующем сбросе.
+        """
+        deltas = {key: delta for key, delta in deltas.items() if delta != (0, 0)}
+        if not deltas:
+            return {}
+        keys = list(deltas)
+        try:
+            await collection.bulk_write([make_op(key, deltas[key]) for key in keys], ordered=False)
+        except BulkWriteError as e:
+            failed = {keys[error["index"]] for error in e.details.get("writeErrors", [])}
+            print(f"Ошибка при обновлении статистики оценок: {e}")
+            return {key: deltas[key] for key in failed}
+        except Exception as e:
+            print(f"Ошибка при обновлении статистики оценок: {e}")
+            return deltas
+        return {}
+
+    @staticmethod
+    def _creator_stats_op(creator_id: int, delta: tuple) -> UpdateOne:
+        return UpdateOne({"_id": creator_id}, RatingCRUD._stats_pipeline(*delta), upsert=True)
+
+    @staticmethod
+    def _bucket_op(bucket: tuple, delta: tuple) -> UpdateOne:
+        creator_id, game, bucket_week = bucket
+        retention = timedelta(weeks=Config.RATING_BUCKET_RETENTION_WEEKS)
+        return UpdateOne(
+            {"creator_id": creator_id, "game": game, "week_start": bucket_week},
+            RatingCRUD._stats_pipeline(*delta, {"expires_at": bucket_week + retention}),
             upsert=True
         )
 
     @staticmethod
-    async def get_average_rating(user_id: int):
-        """
-        Вычисляет средний рейтинг для пользователя, который был оценен (как создатель).
-        """
-        pipeline = [
-            {"$match": {"creator_id": user_id}},
-            {"$group": {"_id": "$creator_id", "average_rating": {"$avg": "$rating"}}}
+    def _stats_pipeline(sum_delta: int, count_delta: int, extra: dict = None) -> list:
+        """
+        Pipeline-обновление: изменяет сумму и количество оценок и пересчитывает среднее.
+        """
+        increments = {
+            "sum": {"$add": [{"$ifNull": ["$sum", 0]}, sum_delta]},
+            "count": {"$add": [{"$ifNull": ["$count", 0]}, count_delta]}
+        }
+        increments.update(extra or {})
+        return [
+            {"$set": increments},
+            {"$set": {
+                "average": {"$cond": [{"$gt": ["$count", 0]}, {"$divide": ["$sum", "$count"]}, 0]}
+            }}
         ]
-        result = await ratings_collection.aggregate(pipeline).to_list(length=1)
-        return result[0]["average_rating"] if result else 0.0
-
-    @staticmethod
-    async def get_all_average_ratings():
-        """
-        Возвращает список всех пользователей с их средними рейтингами,
-        отсортированными по убыванию рейтинга.
-        """
-        pipeline = [
-            # Группируем по creator_id и считаем средний рейтинг для каждого создателя
-            {"$group": {"_id": "$creator_id", "average_rating": {"$avg": "$rating"}}},
-            # Добавляем информацию о пользователе (например, username или first_name)
-            {"$lookup": {
-                "from": "users",  # Название коллекции пользователей
-                "localField": "_id",
-                "foreignField": "_id",
-                "as": "user_info"
-            }},
-            # Разворачиваем массив user_info (т.к. $lookup возвращает массив)
-            {"$unwind": "$user_info"},
-            # Выбираем нужные поля
-            {"$project": {
-                "_id": 0,  # Не включаем _id
-                "user_id": "$_id",
-                "username": "$user_info.username",  # Предполагаем, что username хранится в user_info
-                "first_name": "$user_info.first_name",  # Если username нет, используем first_name
-                "average_rating": {"$round": ["$average_rating", 2]}  # Округляем до 2 знаков
-            }},
-            # Сортируем по рейтингу по убыванию
-            {"$sort": {"average_rating": -1}}
+
+    @staticmethod
+    async def get_top_ratings(limit: int = None, game: str = None, since: datetime = None):
+        """
+        Возвращает первых limit пользователей по среднему рейтингу (по убыванию).
+        Без фильтров читается из индекса creator_stats. С фильтром по игре и/или периоду
+        (since - начало недели, с которой считать) объединяются корзины rating_buckets,
+        которых на окно приходится немного; без since берется весь срок хранения корзин.
+        Имена подтягиваются одним запросом к users.
+        """
+        limit = limit or Config.TOP_LIMIT
+        if game is None and since is None:
+            cursor = creator_stats_collection.find({"count": {"$gt": 0}}).sort(
+                [("average", -1), ("count", -1)]
+            ).limit(limit)
+            top = [{"_id": stats["_id"], "average": stats["average"]} async for stats in cursor]
+        else:
+            match = {}
+            if game is not None:
+                match["game"] = game
+            if since is not None:
+                match["week_start"] = {"$gte": since}
+            top = await rating_buckets_collection.aggregate([
+                {"$match": match},
+                {"$group": {"_id": "$creator_id", "sum": {"$sum": "$sum"}, "count": {"$sum": "$count"}}},
+                {"$match": {"count": {"$gt": 0}}},
+                {"$set": {"average": {"$divide": ["$sum", "$count"]}}},
+                {"$sort": {"average": -1, "count": -1}},
+                {"$limit": limit}
+            ]).to_list(None)
+
+        users = {}
+        if top:
+            users_cursor = users_collection.find(
+                {"_id": {"$in": [stats["_id"] for stats in top]}},
+                {"username": 1, "first_name": 1}
+            )
+            users = {user["_id"]: user async for user in users_cursor}
+
+        return [
+            {
+                "user_id": stats["_id"],
+                "username": users.get(stats["_id"], {}).get("username"),
+                "first_name": users.get(stats["_id"], {}).get("first_name"),
+                "average_rating": round(stats["average"], 2)
+            }
+            for stats in top
         ]
 
-        # Получаем все результаты агрегации
-        results = await ratings_collection.aggregate(pipeline).to_list(None)
-        return results
\ No newline at end of file
+
+rating_buffer = RatingWriteBuffer(Config.RATING_FLUSH_INTERVAL, Config.RATING_BUFFER_MAX_SIZE)
+
+
+class BroadcastCRUD:
+    @staticmethod
+    async def create(event_id: str, text: str, exclude_user_id: int = None, game: str = None):
+        """
+        Создает запись о рассылке. По ней рассылка продолжается после перезапуска.
+        game - рассылка только подписчикам этой игры.
+        """
+        result = await broadcasts_collection.insert_one({
+            "event_id": event_id,
+            "text": text,
+            "game": game,
+            "exclude_user_id": exclude_user_id,
+            "last_user_id": None,
+            "sent": 0,
+            "failed": 0,
+            "finished": False,
+            "created_at": datetime.utcnow()
+        })
+        return str(result.inserted_id)
+
+    @staticmethod
+    async def checkpoint(broadcast_id: str, last_user_id: int, sent: int, failed: int):
+        """
+        Сохраняет прогресс рассылки: ID последнего обработанного пользователя и счетчики.
+        """
+        await broadcasts_collection.update_one(
+            {"_id": ObjectId(broadcast_id)},
+            {"$set": {"last_user_id": last_user_id, "sent": sent, "failed": failed}}
+        )
+
+    @staticmethod
+    async def finish(broadcast_id: str):
+        """
+        Помечает рассылку как завершенную. Через BROADCAST_RETENTION_DAYS запись удаляется по TTL.
+        """
+        now = datetime.utcnow()
+        await broadcasts_collection.update_one(
+            {"_id": ObjectId(broadcast_id)},
+            {"$set": {
+                "finished": True,
+                "finished_at": now,
+                "expires_at": now + timedelta(days=Config.BROADCAST_RETENTION_DAYS),
+            }}
+        )
+
+    @staticmethod
+    async def list_unfinished():
+        """
+        Возвращает список незавершенных рассылок.
+        """
+        cursor = broadcasts_collection.find({"finished": False})
+        return [broadcast async for broadcast in cursor]
@@ -0,0 +1,184 @@
+"""
+Разовые миграции данных.
+
+Запуск: python -m database.migrations
+"""
+import asyncio
+import logging
+
+from pymongo import UpdateOne
+
+from config import Config
+from database import init_db, close_db
+from database.crud import broadcasts_collection, events_collection, ratings_collection, users_collection, \
+    ensure_indexes, to_datetime, _event_end
+from keyboards.builder import GAMES
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+
+async def migrate_event_datetimes():
+    """
+    Переводит поле 'datetime' событий из строк ISO в BSON date и заполняет
+    отсутствующие 'duration' и 'ends_at'. Документы читаются курсором
+    и обновляются пачками через bulk_write, вся коллекция в память не загружается.
+    """
+    cursor = events_collection.find(
+        {"$or": [{"datetime": {"$type": "string"}}, {"ends_at": {"$exists": False}}]},
+        {"datetime": 1, "duration": 1}
+    ).batch_size(BATCH_SIZE)
+
+    operations = []
+    migrated = 0
+    async for event in cursor:
+        start = to_datetime(event.get("datetime"))
+        if start is None:
+            logger.warning("Пропускаем событие %s с некорректной датой: %r", event["_id"], event.get("datetime"))
+            continue
+
+        duration = event.get("duration") or Config.DEFAULT_EVENT_DURATION_HOURS
+        operations.append(UpdateOne(
+            {"_id": event["_id"]},
+            {"$set": {"datetime": start, "duration": duration, "ends_at": _event_end(start, duration)}}
+        ))
+        if len(operations) >= BATCH_SIZE:
+            await events_collection.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+            operations = []
+
+    if operations:
+        await events_collection.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+
+    logger.info("Миграция дат событий: обновлено %s документов", migrated)
+    return migrated
+
+
+async def backfill_participants_count():
+    """
+    Заполняет денормализованный счетчик participants_count по массиву participants.
+    Выполняется одним запросом на стороне базы.
+    """
+    result = await events_collection.update_many(
+        {"participants_count": {"$exists": False}},
+        [{"$set": {"participants_count": {"$size": {"$ifNull": ["$participants", []]}}}}]
+    )
+    logger.info("Счетчик участников заполнен для %s событий", result.modified_count)
+    return result.modified_count
+
+
+async def backfill_user_inactive():
+    """
+    Проставляет inactive=False пользователям без этого поля, чтобы выборка получателей
+    шла по одной точке индекса (inactive, _id).
+    """
+    result = await users_collection.update_many({"inactive": {"$exists": False}}, {"$set": {"inactive": False}})
+    logger.info("Поле inactive заполнено для %s пользователей", result.modified_count)
+    return result.modified_count
+
+
+async def backfill_subscriptions():
+    """
+    Подписывает пользователей, у которых еще нет поля subscriptions, на все игры каталога.
+    До подписок уведомления о новых событиях получали все, поэтому после обновления
+    они продолжают приходить, пока пользователь сам не отпишется в "🔔 Подписки".
+    """
+    result = await users_collection.update_many(
+        {"subscriptions": {"$exists": False}},
+        {"$set": {"subscriptions": list(GAMES)}}
+    )
+    logger.info("Подписки на все игры проставлены %s пользователям", result.modified_count)
+    return result.modified_count
+
+
+async def backfill_broadcast_expiry():
+    """
+    Проставляет expires_at завершенным рассылкам, записанным до появления TTL:
+    через BROADCAST_RETENTION_DAYS после finished_at их удалит индекс.
+    """
+    result = await broadcasts_collection.update_many(
+        {"finished": True, "expires_at": {"$exists": False}},
+        [{"$set": {"expires_at": {"$dateAdd": {
+            "startDate": {"$ifNull": ["$finished_at", "$created_at"]},
+            "unit": "day",
+            "amount": Config.BROADCAST_RETENTION_DAYS
+        }}}}]
+    )
+    logger.info("Срок хранения проставлен %s завершенным рассылкам", result.modified_count)
+    return result.modified_count
+
+
+async def rebuild_creator_stats():
+    """
+    Пересчитывает creator_stats (сумма, количество и среднее оценок создателя)
+    по коллекции ratings. Нужен один раз для уже накопленных оценок.
+    """
+    await ratings_collection.aggregate([
+        {"$group": {"_id": "$creator_id", "sum": {"$sum": "$rating"}, "count": {"$sum": 1}}},
+        {"$set": {"average": {"$divide": ["$sum", "$count"]}}},
+        {"$merge": {"into": "creator_stats", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]).to_list(None)
+    logger.info("Статистика создателей пересчитана")
+
+
+async def rebuild_rating_buckets():
+    """
+    Пересчитывает корзины rating_buckets (создатель, игра, неделя) по коллекции ratings.
+    Игра берется из события, неделя - по времени оценки.
+    """
+    await ratings_collection.aggregate([
+        {"$lookup": {"from": "events", "localField": "event_id", "foreignField": "_id", "as": "event"}},
+        {"$set": {
+            "game": {"$ifNull": ["$game", {"$ifNull": [{"$first": "$event.game"}, "Другое"]}]},
+            "week_start": {"$ifNull": [
+                "$week_start",
+                {"$dateTrunc": {"date": "$timestamp", "unit": "week", "startOfWeek": "monday"}}
+            ]}
+        }},
+        {"$group": {
+            "_id": {"creator_id": "$creator_id", "game": "$game", "week_start": "$week_start"},
+            "sum": {"$sum": "$rating"},
+            "count": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": 0,
+            "creator_id": "$_id.creator_id",
+            "game": "$_id.game",
+            "week_start": "$_id.week_start",
+            "sum": 1,
+            "count": 1,
+            "average": {"$divide": ["$sum", "$count"]},
+            "expires_at": {"$dateAdd": {
+                "startDate": "$_id.week_start", "unit": "week", "amount": Config.RATING_BUCKET_RETENTION_WEEKS
+            }}
+        }},
+        {"$merge": {
+            "into": "rating_buckets",
+            "on": ["creator_id", "game", "week_start"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+    ]).to_list(None)
+    logger.info("Корзины оценок пересчитаны")
+
+
+async def run_all():
+    await init_db()
+    try:
+        await migrate_event_datetimes()
+        await backfill_participants_count()
+        await backfill_user_inactive()
+        await backfill_subscriptions()
+        await backfill_broadcast_expiry()
+        await rebuild_creator_stats()
+        await ensure_indexes()  # $merge по полям требует уникального индекса на них
+        await rebuild_rating_buckets()
+    finally:
+        close_db()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    asyncio.run(run_all())
@@ -0,0 +1,163 @@
+import asyncio
+import pickle
+import time
+from datetime import datetime, timedelta
+
+from bson import Binary
+from pymongo import DeleteOne, ReplaceOne
+from telegram.ext import BasePersistence, PersistenceInput, PicklePersistence
+
+from config import Config
+from database import bot_state_collection
+
+
+class MongoPersistence(BasePersistence):
+    """
+    Хранение состояний ConversationHandler и user_data в коллекции bot_state.
+
+    PTB раз в update_interval передает изменившиеся данные в update_*; здесь они только
+    помечаются "грязными", а в базу уходят одним bulk_write в конце цикла (write-behind).
+    Значения сериализуются pickle в Binary, пустые user_data и завершенные диалоги удаляются.
+    У каждого документа есть expires_at (TTL-индекс), поэтому брошенные диалоги
+    и данные давно неактивных пользователей удаляются самой базой.
+
+    Документы: {_id, kind: "user" | "conversation", name, key, data, expires_at}.
+    """
+
+    def __init__(self, update_interval: float = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval if update_interval is not None else Config.PERSISTENCE_FLUSH_INTERVAL,
+        )
+        self.user_data_ttl = timedelta(days=Config.PERSISTENCE_USER_DATA_TTL_DAYS)
+        self.conversation_ttl = timedelta(hours=Config.CONVERSATION_TIMEOUT_HOURS)
+        self._dirty = {}  # _id -> (kind, name, key, value); value None - удалить документ
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+        self._stats = {"flushes": 0, "documents": 0, "bytes_written": 0, "last_flush_ms": 0.0}
+
+    # --- Грязные записи и сброс ---
+
+    def _mark(self, doc_id: str, kind: str, name, key, value):
+        self._dirty[doc_id] = (kind, name, key, value)
+        # PTB вызывает update_* пачкой; сбрасываем все одним запросом после нее
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        await asyncio.sleep(0)
+        await self.flush()
+
+    def build_operations(self, dirty: dict, now: datetime) -> list:
+        """
+        Превращает грязные записи в операции bulk_write. Сериализация происходит здесь,
+        поэтому в базу попадает последнее состояние, а не промежуточные.
+        """
+        operations = []
+        for doc_id, (kind, name, key, value) in dirty.items():
+            if value is None or value == {}:
+                operations.append(DeleteOne({"_id": doc_id}))
+                continue
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            self._stats["bytes_written"] += len(data)
+            ttl = self.conversation_ttl if kind == "conversation" else self.user_data_ttl
+            operations.append(ReplaceOne(
+                {"_id": doc_id},
+                {"kind": kind, "name": name, "key": key, "data": Binary(data), "expires_at": now + ttl},
+                upsert=True
+            ))
+        return operations
+
+    async def flush(self):
+        async with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            started = time.perf_counter()
+            try:
+                operations = self.build_operations(dirty, datetime.utcnow())
+                await bot_state_collection.bulk_write(operations, ordered=False)
+            except Exception as e:
+                print(f"Ошибка при сохранении состояния бота: {e}")
+                # Несохраненное вернется в следующий сброс, более свежие изменения не затираем
+                for doc_id, entry in dirty.items():
+                    self._dirty.setdefault(doc_id, entry)
+                return
+            self._stats["flushes"] += 1
+            self._stats["documents"] += len(dirty)
+            self._stats["last_flush_ms"] = (time.perf_counter() - started) * 1000
+
+    def stats(self) -> dict:
+        return dict(self._stats, dirty=len(self._dirty))
+
+    # --- Загрузка при старте ---
+
+    async def _load(self, query: dict) -> list:
+        query["expires_at"] = {"$gt": datetime.utcnow()}  # TTL-монитор удаляет с задержкой
+        return await bot_state_collection.find(query, {"key": 1, "data": 1}).to_list(None)
+
+    async def get_user_data(self):
+        return {doc["key"]: pickle.loads(doc["data"]) for doc in await self._load({"kind": "user"})}
+
+    async def get_conversations(self, name: str):
+        docs = await self._load({"kind": "conversation", "name": name})
+        return {tuple(doc["key"]): pickle.loads(doc["data"]) for doc in docs}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # --- Изменения от PTB ---
+
+    async def update_user_data(self, user_id: int, data: dict):
+        self._mark(f"u:{user_id}", "user", None, user_id, data)
+
+    async def drop_user_data(self, user_id: int):
+        self._mark(f"u:{user_id}", "user", None, user_id, None)
+
+    async def update_conversation(self, name: str, key, new_state):
+        self._mark(f"c:{name}:{key}", "conversation", name, list(key), new_state)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    # chat_data, bot_data и callback_data бот не использует (см. store_data)
+
+    async def update_chat_data(self, chat_id: int, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+
+def create_persistence():
+    """
+    Хранилище состояния по Config.PERSISTENCE_BACKEND: MongoDB, локальный файл или ничего.
+    """
+    backend = Config.PERSISTENCE_BACKEND
+    if backend == "mongo":
+        return MongoPersistence()
+    if backend == "file":
+        return PicklePersistence(
+            Config.PERSISTENCE_FILE,
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=Config.PERSISTENCE_FLUSH_INTERVAL,
+        )
+    return None
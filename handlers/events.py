@@ -8,17 +8,27 @@ from telegram.ext import (
     filters,
 )
 from datetime import datetime, timedelta
+from config import Config
 from database.crud import EventCRUD, UserCRUD, RatingCRUD  # Добавляем UserCRUD и RatingCRUD
-from keyboards.builder import KeyboardBuilder
+from keyboards.builder import KeyboardBuilder, GAMES, parse_page_callback_data
+from utils import callback_codec
+from utils.broadcast import broadcaster
+from utils.formatting import format_event_datetime
+from utils.outbound import REMINDER_LIMIT_ARGS, handle_send_error
+from utils.router import router
 
 # Состояния для создания события
 DATE, TIME, GAME, DESCRIPTION, PARTICIPANT_LIMIT = range(5)  # Новые состояния, DURATION удален
 
 # Состояния для редактирования события
 EDIT_CHOICE, EDIT_DATE, EDIT_TIME, EDIT_GAME, EDIT_DESCRIPTION, EDIT_LIMIT = range(6)
-
-# Состояния для рейтинга
-RATING = range(1)
+# Поля события, которые диалог создания собирает в user_data
+EVENT_FIELDS = ("datetime", "game", "description", "participant_limit", "participants", "creator_id", "creator_name")
+# Временные ключи user_data диалогов создания и редактирования
+CREATION_DRAFT_KEYS = ("datetime_date", "datetime", "game", "description", "participant_limit", "participants",
+                       "creator_id", "creator_name", "calendar_year", "calendar_month")
+EDIT_DRAFT_KEYS = ("edit_event_id", "edit_datetime_date", "calendar_year", "calendar_month")
+EDIT_FIELD_CALLBACKS = ("edit_field_datetime", "edit_field_game", "edit_field_description", "edit_field_limit")
 
 
 async def show_event_filters(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -28,51 +38,114 @@ async def show_event_filters(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
 
 
+def _filter_range(filter_type: str, now: datetime):
+    """
+    Возвращает границы (start, end) для пресета фильтра. end=None - без верхней границы.
+    """
+    today = datetime(now.year, now.month, now.day)
+    day_end = timedelta(hours=23, minutes=59, seconds=59)
+    if filter_type == "today":
+        return today, today + day_end
+    if filter_type == "tomorrow":
+        tomorrow = today + timedelta(days=1)
+        return tomorrow, tomorrow + day_end
+    if filter_type == "week":  # До конца текущей недели (воскресенья)
+        return today, today + timedelta(days=6 - today.weekday()) + day_end
+    if filter_type == "weekend":  # Ближайшие суббота и воскресенье
+        saturday = today + timedelta(days=max(0, 5 - today.weekday()))
+        return saturday, today + timedelta(days=6 - today.weekday()) + day_end
+    return today, None  # filter_all
+
+
+async def _reply_with_filtered_events(query, context: ContextTypes.DEFAULT_TYPE, start: datetime, end):
+    # Диапазон запоминаем, чтобы кнопки листания могли запросить следующие страницы
+    context.user_data['events_filter'] = (start, end)
+    page = await _render_events_page("f", context, query.from_user.id)
+
+    if page is None:
+        await query.message.reply_text("❌ Активных событий по выбранному фильтру не найдено.")
+        return
+
+    text, keyboard = page
+    await query.message.reply_text(text, reply_markup=keyboard)
+
+
 async def apply_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     filter_type = query.data.split("_")[1]
 
-    now = datetime.utcnow()  # Используем UTC для консистентности с сохранением в БД
-    if filter_type == "today":
-        start = datetime(now.year, now.month, now.day)
-        end = datetime(now.year, now.month, now.day, 23, 59, 59)
-    elif filter_type == "tomorrow":
-        tomorrow = now + timedelta(days=1)
-        start = datetime(tomorrow.year, tomorrow.month, tomorrow.day)
-        end = datetime(tomorrow.year, tomorrow.month, tomorrow.day, 23, 59, 59)
-    else:  # filter_all
-        start = datetime.min  # Минимальная дата для всех
-        end = datetime.max  # Максимальная дата для всех
-
-    events = await EventCRUD.list_all()  # Получаем все события, затем фильтруем
-
-    filtered_events = []
-    for e in events:
-        try:
-            event_dt = datetime.fromisoformat(e['datetime'])
-            if start <= event_dt <= end:
-                filtered_events.append(e)
-        except ValueError:
-            # Обработка событий с некорректной датой, можно логировать или пропустить
-            pass
-
-    # Отфильтруем только активные события, которые еще не прошли
-    active_filtered_events = [
-        e for e in filtered_events
-        if datetime.fromisoformat(e['datetime']) >= datetime.utcnow()
-    ]
-
-    if not active_filtered_events:
-        await query.message.reply_text("❌ Активных событий по выбранному фильтру не найдено.")
+    if filter_type == "custom":
+        # Период выбирается двумя нажатиями в календаре: начальная и конечная дата
+        now = datetime.now()
+        context.user_data.pop('filter_range_start', None)
+        await query.message.reply_text(
+            "📅 Выберите начальную дату периода:",
+            reply_markup=KeyboardBuilder.build_calendar(now.year, now.month, prefix="range_")
+        )
         return
 
-    # Изменили цикл для использования active_events_list
-    keyboard = KeyboardBuilder.active_events_list(active_filtered_events, query.from_user.id)
-    await query.message.reply_text(
-        "Вот список событий:",
-        reply_markup=keyboard
-    )
+    start, end = _filter_range(filter_type, datetime.utcnow())  # UTC, как и даты в БД
+    await _reply_with_filtered_events(query, context, start, end)
+
+
+async def filter_range_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    action, args = callback_codec.decode(query.data)
+
+    if action == "range_month":
+        year, month = _shift_month(*args)
+        await query.edit_message_reply_markup(
+            reply_markup=KeyboardBuilder.build_calendar(year, month, prefix="range_")
+        )
+        return
+
+    if action == "range_day":
+        selected = datetime(*args)
+        range_start = context.user_data.get('filter_range_start')
+
+        if range_start is None:
+            context.user_data['filter_range_start'] = selected
+            await query.edit_message_text(
+                f"Начало периода: {selected.strftime('%d.%m.%Y')}\nТеперь выберите конечную дату:",
+                reply_markup=KeyboardBuilder.build_calendar(selected.year, selected.month, prefix="range_")
+            )
+            return
+
+        context.user_data.pop('filter_range_start', None)
+        start, end = sorted([range_start, selected])
+        await query.edit_message_text(f"Период: {start.strftime('%d.%m.%Y')} — {end.strftime('%d.%m.%Y')}")
+        await _reply_with_filtered_events(query, context, start, end + timedelta(hours=23, minutes=59, seconds=59))
+
+
+def _shift_month(year: int, month: int, delta: int):
+    """
+    Сдвигает (год, месяц) на delta месяцев (кнопки ◀️/▶️ календаря).
+    """
+    index = year * 12 + month - 1 + delta
+    return index // 12, index % 12 + 1
+
+
+def _format_date(year: int, month: int, day: int) -> str:
+    return f"{year}-{month:02d}-{day:02d}"
+
+
+def _format_time(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _decode_game(data: str):
+    """
+    Название игры из callback_data кнопки выбора игры или None.
+    """
+    try:
+        action, (index,) = callback_codec.decode(data)
+    except (callback_codec.CallbackDataError, ValueError):
+        return None
+    if action != "game" or index >= len(GAMES):
+        return None
+    return GAMES[index]
 
 
 async def create_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -88,48 +161,21 @@ async def create_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def date_time_picker_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    data = query.data
-
-    if data == 'ignore':
-        return DATE
-
-    if data.startswith("prev_month_"):
-        _, _, year, month = data.split("_")
-        year = int(year)
-        month = int(month)
-
-        if month == 1:
-            month = 12
-            year -= 1
-        else:
-            month -= 1
-
-        context.user_data['calendar_year'] = year
-        context.user_data['calendar_month'] = month
-        calendar = KeyboardBuilder.build_calendar(year, month)
-        await query.edit_message_reply_markup(reply_markup=calendar)
+    try:
+        action, args = callback_codec.decode(query.data)
+    except callback_codec.CallbackDataError:  # 'ignore' и чужие кнопки
         return DATE
 
-    if data.startswith("next_month_"):
-        _, _, year, month = data.split("_")
-        year = int(year)
-        month = int(month)
-
-        if month == 12:
-            month = 1
-            year += 1
-        else:
-            month += 1
-
+    if action == "month":
+        year, month = _shift_month(*args)
         context.user_data['calendar_year'] = year
         context.user_data['calendar_month'] = month
         calendar = KeyboardBuilder.build_calendar(year, month)
         await query.edit_message_reply_markup(reply_markup=calendar)
         return DATE
 
-    if data.startswith('day_'):
-        _, year, month, day = data.split('_')
-        date_str = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+    if action == "day":
+        date_str = _format_date(*args)
         context.user_data['datetime_date'] = date_str
 
         await query.edit_message_text(
@@ -138,8 +184,8 @@ async def date_time_picker_handler(update: Update, context: ContextTypes.DEFAULT
         )
         return TIME
 
-    if data.startswith('time_'):
-        time_str = data.split('_')[1]
+    if action == "time":
+        time_str = _format_time(*args)
         date_str = context.user_data.get('datetime_date')
         if not date_str:
             await query.edit_message_text("Ошибка: сначала выберите дату.")
@@ -161,12 +207,11 @@ async def process_game_choice(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
 
-    data = query.data
-    if not data.startswith("game_"):
+    game = _decode_game(query.data)
+    if game is None:
         await query.message.reply_text("Пожалуйста, выберите игру, используя кнопки.")
         return GAME
 
-    game = data[len("game_"):]
     context.user_data["game"] = game
 
     await query.edit_message_text(
@@ -202,15 +247,17 @@ async def process_participant_limit(update: Update, context: ContextTypes.DEFAUL
                 creator_name = f"Пользователь {update.message.from_user.id}"
         context.user_data["creator_name"] = creator_name
 
-        # Здесь сохраняем событие
-        new_event_id = await EventCRUD.create(context.user_data)
+        # Здесь сохраняем событие. В документ попадают только поля события,
+        # а не все содержимое user_data (фильтры, черновики других диалогов)
+        new_event_id = await EventCRUD.create(
+            {key: context.user_data[key] for key in EVENT_FIELDS if key in context.user_data}
+        )
+        _clear_creation_draft(context)
         await update.message.reply_text("✅ Событие создано!")
 
         # --- Уведомление о новом событии ---
         new_event = await EventCRUD.get(new_event_id)
         if new_event:
-            all_users = await UserCRUD.list_all_users()
-
             # Форматируем лимит для отображения
             display_limit = new_event.get('participant_limit', 0)
             limit_text_for_display = f" / {display_limit}" if display_limit > 0 else " / ∞"
@@ -220,19 +267,18 @@ async def process_participant_limit(update: Update, context: ContextTypes.DEFAUL
                 f"🎮 Игра: {new_event.get('game', 'Без названия')}\n"
                 f"📝 Описание: {new_event.get('description', 'Нет')}\n"
                 f"👥 Участников: {len(new_event.get('participants', []))}{limit_text_for_display}\n"
-                f"📅 Дата и время: {datetime.fromisoformat(new_event.get('datetime', '')).strftime('%d.%m.%Y %H:%M')}\n"
+                f"📅 Дата и время: {format_event_datetime(new_event.get('datetime'))}\n"
                 f"Создатель: {new_event.get('creator_name', 'Неизвестен')}"
             )
-            for user_id in all_users:
-                if user_id != update.message.from_user.id:  # Не отправляем создателю, он уже получил подтверждение
-                    try:
-                        await context.bot.send_message(
-                            chat_id=user_id,
-                            text=notification_text,
-                            reply_markup=KeyboardBuilder.event_actions(new_event_id)  # Кнопки присоединиться/подробнее
-                        )
-                    except Exception as e:
-                        print(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
+            # Рассылка идет в фоне, создатель не ждет ее окончания и сам уведомление не получает.
+            # Уведомление получают только подписчики игры (кнопка "🔔 Подписки")
+            await broadcaster.submit(
+                context.application,
+                event_id=new_event_id,
+                text=notification_text,
+                exclude_user_id=update.message.from_user.id,
+                game=new_event.get("game")
+            )
         # --- Конец уведомления ---
 
         return ConversationHandler.END
@@ -242,55 +288,67 @@ async def process_participant_limit(update: Update, context: ContextTypes.DEFAUL
 
 
 async def cancel_creation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _clear_creation_draft(context)
     await update.message.reply_text("🚫 Создание события отменено.")
     return ConversationHandler.END
 
 
+def _clear_creation_draft(context: ContextTypes.DEFAULT_TYPE):
+    for key in CREATION_DRAFT_KEYS:
+        context.user_data.pop(key, None)
+
+
 async def join_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    event_id = query.data.split("_")[1]
+    _, (event_id,) = callback_codec.decode(query.data)
     user_id = query.from_user.id
 
-    event = await EventCRUD.get(event_id)
-    if not event:
-        await query.message.reply_text("❌ Событие не найдено.")
-        return
-
-    # Проверяем, является ли пользователь создателем события
-    if event.get("creator_id") == user_id:
-        await query.message.reply_text("Вы не можете присоединиться к своему собственному событию.")
-        return
-
-    # Проверяем, участвует ли пользователь уже в событии
-    if user_id in event.get("participants", []):
-        await query.message.reply_text("Вы уже участвуете в этом событии!")
-        return
-
-    # Проверяем лимит участников
-    current_participants_count = len(event.get("participants", []))
-    participant_limit = event.get("participant_limit", 0)
-    if participant_limit > 0 and current_participants_count >= participant_limit:
-        await query.message.reply_text("Извините, все места в этом событии уже заняты.")
+    # Все проверки (создатель, уже участвует, лимит) выполняются атомарно в одном запросе
+    updated_event = await EventCRUD.add_participant(event_id, user_id)
+    if updated_event is None:
+        # Присоединиться не удалось - выясняем причину, чтобы показать понятное сообщение
+        event = await EventCRUD.get(event_id)
+        if not event:
+            await query.message.reply_text("❌ Событие не найдено.")
+        elif event.get("creator_id") == user_id:
+            await query.message.reply_text("Вы не можете присоединиться к своему собственному событию.")
+        elif user_id in event.get("participants", []):
+            await query.message.reply_text("Вы уже участвуете в этом событии!")
+        else:
+            await query.message.reply_text("Извините, все места в этом событии уже заняты.")
         return
 
-    updated_event = await EventCRUD.add_participant(event_id, user_id)
-    participants_count = len(updated_event.get("participants", []))
+    participants_count = updated_event.get("participants_count", len(updated_event.get("participants", [])))
 
     display_limit = updated_event.get('participant_limit', 0)
     limit_text_for_display = f" / {display_limit}" if display_limit > 0 else " / ∞"
 
     # Обновляем сообщение с кнопками, чтобы показать актуальное количество участников
-    await query.message.edit_reply_markup(reply_markup=KeyboardBuilder.event_actions(str(updated_event["_id"])))
+    await query.message.edit_reply_markup(reply_markup=KeyboardBuilder.event_actions(updated_event["_id"]))
     await query.message.reply_text(
         f"✅ Вы присоединились к '{updated_event['game']}'! Теперь участников: {participants_count}{limit_text_for_display}",
     )
 
 
+async def leave_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    _, (event_id,) = callback_codec.decode(query.data)
+
+    updated_event = await EventCRUD.remove_participant(event_id, query.from_user.id)
+    if updated_event is None:
+        await query.message.reply_text("Вы не участвуете в этом событии.")
+        return
+
+    await query.edit_message_reply_markup(reply_markup=KeyboardBuilder.event_actions(event_id))
+    await query.message.reply_text(f"🚪 Вы покинули событие '{updated_event.get('game', 'Без названия')}'.")
+
+
 async def event_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    event_id = query.data.split("_")[1]
+    _, (event_id,) = callback_codec.decode(query.data)
 
     event = await EventCRUD.get(event_id)
     if not event:
@@ -298,12 +356,7 @@ async def event_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Форматируем дату и время для более читабельного вида
-    datetime_str = event.get("datetime", "")
-    try:
-        dt_object = datetime.fromisoformat(datetime_str)
-        formatted_datetime = dt_object.strftime("%d.%m.%Y %H:%M")
-    except ValueError:
-        formatted_datetime = datetime_str  # Если формат не ISO, оставляем как есть
+    formatted_datetime = format_event_datetime(event.get("datetime"))
 
     description = event.get("description", "Нет описания")  # Добавлено
     limit = event.get("participant_limit", 0)  # Добавлено
@@ -317,137 +370,150 @@ async def event_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"👥 Участников: {len(event.get('participants', []))}{limit_text}\n"  # Обновлено
         f"Создатель: {event.get('creator_name', 'Неизвестен')}"
     )
-    await query.message.reply_text(text)
 
+    # Участник (но не создатель) может покинуть событие
+    user_id = query.from_user.id
+    reply_markup = None
+    if user_id in event.get("participants", []) and user_id != event.get("creator_id"):
+        reply_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🚪 Покинуть событие", callback_data=callback_codec.encode("leave", event_id))]
+        ])
+    await query.message.reply_text(text, reply_markup=reply_markup)
+
+
+def _my_events_text(events: list, past: bool) -> str:
+    lines = ["Ваши прошедшие события:" if past else "Вот список ваших событий:", ""]
+    for event in events:
+        # Роль пользователя вычисляется в запросе (поле role)
+        status_text = "(Создатель)" if event.get("role") == "creator" else "(Участник)"
+        limit = event.get("participant_limit", 0)
+        limit_text = f" / {limit}" if limit > 0 else " / ∞"
+        description = event.get("description", "Нет описания")
+        if len(description) > 100:
+            description = description[:97] + "..."
+
+        lines.append(
+            f"🎮 {event.get('game', 'Без названия')} {status_text}\n"
+            f"📝 Описание: {description}\n"
+            f"📅 {format_event_datetime(event.get('datetime'))}\n"
+            f"👥 Участников: {event.get('participants_count', 0)}{limit_text}\n"
+            f"Создатель: {event.get('creator_name', 'Неизвестен')}\n"
+        )
+    return "\n".join(lines)
+
+
+async def _render_events_page(kind: str, context: ContextTypes.DEFAULT_TYPE, user_id: int,
+                              cursor: tuple = None, direction: str = "next"):
+    """
+    Готовит одну страницу списка событий: (текст, клавиатура) или None, если событий нет.
+    kind: "a" - активные события других пользователей, "f" - результаты фильтра,
+    "m" - мои предстоящие события, "h" - мои прошедшие события (сначала недавние).
+    """
+    # Списку не нужен полный массив участников - только их число и участие текущего пользователя
+    projection = EventCRUD.card_projection(user_id)
+    if kind in ("m", "h"):
+        past = kind == "h"
+        events, has_prev, has_next = await EventCRUD.list_user_events(
+            user_id, cursor, direction, projection=projection, when="past" if past else "upcoming"
+        )
+        if not events:
+            if cursor is not None:
+                return None
+            # Пустой список - оставляем кнопку переключения между предстоящими и прошедшими
+            empty_text = "😔 У вас нет прошедших событий." if past else "😔 У вас нет предстоящих событий."
+            return empty_text, KeyboardBuilder.my_events_list([], past=past)
+        pagination = KeyboardBuilder.pagination_row(kind, events, has_prev, has_next)
+        return _my_events_text(events, past), KeyboardBuilder.my_events_list(events, pagination, past)
+
+    if kind == "f":
+        date_filter = context.user_data.get('events_filter')
+        if not date_filter:
+            return None
+        events, has_prev, has_next = await EventCRUD.filter_by_date(*date_filter, cursor=cursor, direction=direction,
+                                                                    projection=projection)
+        text = "Вот список событий:"
+    else:
+        events, has_prev, has_next = await EventCRUD.list_active_exclude_user(user_id, cursor, direction,
+                                                                              projection=projection)
+        text = "Вот список активных событий, созданных другими пользователями:"
 
-async def my_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.message.from_user.id
+    if not events:
+        return None
+    pagination = KeyboardBuilder.pagination_row(kind, events, has_prev, has_next)
+    return text, KeyboardBuilder.active_events_list(events, user_id, pagination)
 
-    # Получаем события, созданные пользователем
-    created_events = await EventCRUD.list_by_creator(user_id)
-    # Получаем события, в которых пользователь участвует
-    participated_events = await EventCRUD.list_participated_by_user(user_id)
-
-    # Используем словарь для хранения уникальных событий по ID
-    all_user_events_dict = {}
-    for event in created_events:
-        all_user_events_dict[str(event["_id"])] = event
-    for event in participated_events:
-        # Добавляем или перезаписываем, если событие уже есть (например, если пользователь и создатель, и участник)
-        all_user_events_dict[str(event["_id"])] = event
-
-        # Преобразуем обратно в список для сортировки
-    all_user_events = list(all_user_events_dict.values())
-    all_user_events.sort(key=lambda e: datetime.fromisoformat(e.get("datetime", datetime.min.isoformat())))
-
-    if not all_user_events:
-        await update.message.reply_text("😔 Вы пока не создали и не участвуете ни в одном событии.")
-        return
 
-    await update.message.reply_text("Вот список ваших событий:")
-    for event_id, event in all_user_events_dict.items():
-        datetime_str = event.get("datetime", "")
-        try:
-            dt_object = datetime.fromisoformat(datetime_str)
-            formatted_datetime = dt_object.strftime("%d.%m.%Y %H:%M")
-        except ValueError:
-            formatted_datetime = datetime_str
-
-        status_text = ""
-        is_creator = False
-        if event.get("creator_id") == user_id:
-            status_text = "(Создатель)"
-            is_creator = True
-        elif user_id in event.get("participants", []):
-            status_text = "(Участник)"
+async def my_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.message.from_user.id
 
-        description = event.get("description", "Нет описания")  # Добавлено
-        limit = event.get("participant_limit", 0)  # Добавлено
-        limit_text = f" / {limit}" if limit > 0 else " / ∞"
+    # Одна страница - одно сообщение, листание редактирует его на месте
+    text, keyboard = await _render_events_page("m", context, user_id)
+    await update.message.reply_text(text, reply_markup=keyboard)
 
-        text = (
-            f"🎮 {event['game']} {status_text}\n"
-            f"📝 Описание: {description}\n"  # Добавлено
-            f"📅 {formatted_datetime}\n"
-            f"👥 Участников: {len(event.get('participants', []))}{limit_text}\n"  # Обновлено
-            f"Создатель: {event.get('creator_name', 'Неизвестен')}"
-        )
 
-        # Добавляем кнопки управления только для созданных событий
-        if is_creator:
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("✏️ Редактировать", callback_data=f"edit_event_{event_id}")],
-                [InlineKeyboardButton("🗑️ Отменить", callback_data=f"cancel_event_{event_id}")]
-            ])
-            await update.message.reply_text(text, reply_markup=keyboard)
-        else:
-            # Для участников - просто информация или кнопки присоединения/подробнее
-            await update.message.reply_text(text, reply_markup=KeyboardBuilder.event_actions(str(event["_id"])))
+async def my_events_switch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Переключение между предстоящими и прошедшими событиями (my_events_upcoming / my_events_past)
+    query = update.callback_query
+    await query.answer()
+    kind = "h" if query.data == "my_events_past" else "m"
+    text, keyboard = await _render_events_page(kind, context, query.from_user.id)
+    await query.edit_message_text(text, reply_markup=keyboard)
 
 
 async def active_events_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    events = await EventCRUD.list_active_exclude_user(user_id)  # Используем новый метод
+    page = await _render_events_page("a", context, user_id)
 
-    if not events:
+    if page is None:
         await update.message.reply_text("❌ Активных событий других пользователей не найдено.")
         return
 
-    keyboard = KeyboardBuilder.active_events_list(events,
-                                                  user_id)  # Передаем user_id для правильного отображения кнопки
-    await update.message.reply_text(
-        "Вот список активных событий, созданных другими пользователями:",
-        reply_markup=keyboard
-    )
+    text, keyboard = page
+    await update.message.reply_text(text, reply_markup=keyboard)
 
 
-# Обработчик для запроса оценки
-async def request_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def events_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-    _, event_id, creator_id = query.data.split("_")
+    kind, direction, cursor = parse_page_callback_data(query.data)
 
-    context.user_data['rating_event_id'] = event_id
-    context.user_data['rating_creator_id'] = int(creator_id)  # Сохраняем ID создателя для оценки
+    page = await _render_events_page(kind, context, query.from_user.id, cursor, direction)
+    if page is None:
+        await query.answer("Больше событий нет.")
+        return
 
-    await query.message.reply_text("Пожалуйста, оцените создателя события от 1 до 5:")
-    return RATING
+    await query.answer()
+    text, keyboard = page
+    await query.edit_message_text(text, reply_markup=keyboard)
 
 
-# Обработчик для получения оценки
-async def process_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        rating = int(update.message.text)
-        if not (1 <= rating <= 5):
-            await update.message.reply_text("❌ Оценка должна быть числом от 1 до 5. Попробуйте еще раз.")
-            return RATING
-
-        event_id = context.user_data.get('rating_event_id')
-        creator_id = context.user_data.get('rating_creator_id')
-        rater_id = update.message.from_user.id
+# Оценка создателя одним нажатием: в кнопке закодированы событие, создатель и число звезд
+async def rate_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    _, (event_id, creator_id, rating) = callback_codec.decode(query.data)
+    rater_id = query.from_user.id
 
-        if not event_id or not creator_id:
-            await update.message.reply_text("Произошла ошибка при обработке оценки. Пожалуйста, попробуйте позже.")
-            return ConversationHandler.END
+    if not (1 <= rating <= 5) or rater_id == creator_id:
+        await query.answer("Эту оценку нельзя поставить.")
+        return
 
-        await RatingCRUD.add_rating(event_id, creator_id, rater_id, rating)
-        await update.message.reply_text("✅ Ваша оценка принята! Спасибо!")
+    # Запись уходит в буфер и сохраняется пачкой вместе с другими оценками
+    await RatingCRUD.add_rating(event_id, creator_id, rater_id, rating)
+    await query.answer("✅ Оценка принята!")
+    await query.edit_message_text(f"{query.message.text}\n\n✅ Ваша оценка: {rating}⭐ Спасибо!")
 
-        # Очищаем данные из user_data
-        context.user_data.pop('rating_event_id', None)
-        context.user_data.pop('rating_creator_id', None)
 
-        return ConversationHandler.END
-    except ValueError:
-        await update.message.reply_text("❌ Введите число. Попробуйте еще раз.")
-        return RATING
+# --- НОВЫЕ ОБРАБОТЧИКИ ДЛЯ РЕДАКТИРОВАНИЯ СОБЫТИЙ ---
+def _end_edit(context: ContextTypes.DEFAULT_TYPE):
+    # Черновик редактирования больше не нужен: не храним его в user_data и в хранилище состояния
+    for key in EDIT_DRAFT_KEYS:
+        context.user_data.pop(key, None)
+    return ConversationHandler.END
 
 
-# --- НОВЫЕ ОБРАБОТЧИКИ ДЛЯ РЕДАКТИРОВАНИЯ СОБЫТИЙ ---
 async def edit_event_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    event_id = query.data.split("_")[2]  # edit_event_<event_id>
+    _, (event_id,) = callback_codec.decode(query.data)
 
     event = await EventCRUD.get(event_id)
     if not event:
@@ -458,7 +524,8 @@ async def edit_event_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.message.reply_text("🚫 Вы не можете редактировать это событие, так как не являетесь его создателем.")
         return ConversationHandler.END
 
-    context.user_data['event_to_edit'] = event  # Сохраняем событие для редактирования
+    # В user_data (и в хранилище состояния) кладем только ID, само событие читаем при сохранении
+    context.user_data['edit_event_id'] = str(event["_id"])
 
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("📅 Дату и Время", callback_data="edit_field_datetime")],
@@ -476,11 +543,11 @@ async def edit_field_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     choice = query.data.split("_")[2]  # edit_field_<choice>
-    event_to_edit = context.user_data.get('event_to_edit')
+    event_id = context.user_data.get('edit_event_id')
 
-    if not event_to_edit:
+    if not event_id:
         await query.message.reply_text("Ошибка: событие для редактирования не найдено.")
-        return ConversationHandler.END
+        return _end_edit(context)
 
     if choice == "datetime":
         now = datetime.now()
@@ -500,47 +567,33 @@ async def edit_field_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return EDIT_LIMIT
     elif choice == "cancel":
         await query.message.reply_text("Редактирование отменено.")
-        return ConversationHandler.END
+        return _end_edit(context)
     return EDIT_CHOICE  # Остаемся в этом состоянии, если выбор не обработан
 
 
 async def edit_datetime_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    data = query.data
-
-    if data == 'ignore':
+    try:
+        action, args = callback_codec.decode(query.data)
+    except callback_codec.CallbackDataError:  # 'ignore' и чужие кнопки
         return EDIT_DATE
 
-    event_to_edit = context.user_data.get('event_to_edit')
-    if not event_to_edit:
+    event_id = context.user_data.get('edit_event_id')
+    if not event_id:
         await query.edit_message_text("Ошибка: событие для редактирования не найдено.")
-        return ConversationHandler.END
+        return _end_edit(context)
 
-    if data.startswith("prev_month_") or data.startswith("next_month_"):
-        _, _, year, month = data.split("_")
-        year = int(year)
-        month = int(month)
-
-        if data.startswith("prev_month_"):
-            if month == 1:
-                month = 12; year -= 1
-            else:
-                month -= 1
-        else:  # next_month_
-            if month == 12:
-                month = 1; year += 1
-            else:
-                month += 1
+    if action == "month":
+        year, month = _shift_month(*args)
         context.user_data['calendar_year'] = year
         context.user_data['calendar_month'] = month
         calendar = KeyboardBuilder.build_calendar(year, month)
         await query.edit_message_reply_markup(reply_markup=calendar)
         return EDIT_DATE
 
-    if data.startswith('day_'):
-        _, year, month, day = data.split('_')
-        date_str = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+    if action == "day":
+        date_str = _format_date(*args)
         context.user_data['edit_datetime_date'] = date_str  # Сохраняем временно
 
         await query.edit_message_text(
@@ -549,8 +602,8 @@ async def edit_datetime_handler(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return EDIT_TIME
 
-    if data.startswith('time_'):
-        time_str = data.split('_')[1]
+    if action == "time":
+        time_str = _format_time(*args)
         date_str = context.user_data.get('edit_datetime_date')
         if not date_str:
             await query.edit_message_text("Ошибка: сначала выберите дату.")
@@ -559,62 +612,58 @@ async def edit_datetime_handler(update: Update, context: ContextTypes.DEFAULT_TY
         full_datetime = f"{date_str} {time_str}"
 
         updated = await EventCRUD.update_event(
-            str(event_to_edit["_id"]),
+            event_id,
             {"datetime": full_datetime}
         )
         if updated:
             await query.edit_message_text(f"✅ Дата и время события обновлены на: {full_datetime}")
-            # Обновляем сохраненное событие в user_data, чтобы последующие изменения работали с актуальными данными
-            updated_event_data = await EventCRUD.get(str(event_to_edit["_id"]))
-            context.user_data['event_to_edit'] = updated_event_data
         else:
             await query.edit_message_text("❌ Не удалось обновить дату и время.")
-        return ConversationHandler.END
+        return _end_edit(context)
     return EDIT_DATE
 
 
 async def edit_game_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    game = query.data.split('_')[1]  # game_<game_name>
+    game = _decode_game(query.data)
+    if game is None:
+        await query.message.reply_text("Пожалуйста, выберите игру, используя кнопки.")
+        return EDIT_GAME
 
-    event_to_edit = context.user_data.get('event_to_edit')
-    if not event_to_edit:
+    event_id = context.user_data.get('edit_event_id')
+    if not event_id:
         await query.edit_message_text("Ошибка: событие для редактирования не найдено.")
-        return ConversationHandler.END
+        return _end_edit(context)
 
     updated = await EventCRUD.update_event(
-        str(event_to_edit["_id"]),
+        event_id,
         {"game": game}
     )
     if updated:
         await query.edit_message_text(f"✅ Игра события обновлена на: {game}")
-        updated_event_data = await EventCRUD.get(str(event_to_edit["_id"]))
-        context.user_data['event_to_edit'] = updated_event_data
     else:
         await query.edit_message_text("❌ Не удалось обновить игру.")
-    return ConversationHandler.END
+    return _end_edit(context)
 
 
 async def edit_description_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     description = update.message.text
 
-    event_to_edit = context.user_data.get('event_to_edit')
-    if not event_to_edit:
+    event_id = context.user_data.get('edit_event_id')
+    if not event_id:
         await update.message.reply_text("Ошибка: событие для редактирования не найдено.")
-        return ConversationHandler.END
+        return _end_edit(context)
 
     updated = await EventCRUD.update_event(
-        str(event_to_edit["_id"]),
+        event_id,
         {"description": description}
     )
     if updated:
         await update.message.reply_text(f"✅ Описание события обновлено: {description}")
-        updated_event_data = await EventCRUD.get(str(event_to_edit["_id"]))
-        context.user_data['event_to_edit'] = updated_event_data
     else:
         await update.message.reply_text("❌ Не удалось обновить описание.")
-    return ConversationHandler.END
+    return _end_edit(context)
 
 
 async def edit_limit_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -624,22 +673,20 @@ async def edit_limit_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await update.message.reply_text("❌ Количество участников не может быть отрицательным. Введите число.")
             return EDIT_LIMIT
 
-        event_to_edit = context.user_data.get('event_to_edit')
-        if not event_to_edit:
+        event_id = context.user_data.get('edit_event_id')
+        if not event_id:
             await update.message.reply_text("Ошибка: событие для редактирования не найдено.")
-            return ConversationHandler.END
+            return _end_edit(context)
 
         updated = await EventCRUD.update_event(
-            str(event_to_edit["_id"]),
+            event_id,
             {"participant_limit": limit}
         )
         if updated:
             await update.message.reply_text(f"✅ Лимит участников обновлен на: {limit if limit > 0 else 'Безлимит'}")
-            updated_event_data = await EventCRUD.get(str(event_to_edit["_id"]))
-            context.user_data['event_to_edit'] = updated_event_data
         else:
             await update.message.reply_text("❌ Не удалось обновить лимит.")
-        return ConversationHandler.END
+        return _end_edit(context)
     except ValueError:
         await update.message.reply_text("❌ Введите число. Попробуйте еще раз.")
         return EDIT_LIMIT
@@ -652,14 +699,14 @@ async def edit_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.callback_query.message.reply_text("Редактирование отменено.")
     else:
         await update.message.reply_text("Редактирование отменено.")
-    return ConversationHandler.END
+    return _end_edit(context)
 
 
 # --- НОВЫЕ ОБРАБОТЧИКИ ДЛЯ ОТМЕНЫ СОБЫТИЯ ---
 async def cancel_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    event_id = query.data.split("_")[2]  # cancel_event_<event_id>
+    _, (event_id,) = callback_codec.decode(query.data)
 
     event = await EventCRUD.get(event_id)
     if not event:
@@ -672,7 +719,7 @@ async def cancel_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Подтверждение отмены
     keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("✅ Подтвердить отмену", callback_data=f"confirm_cancel_event_{event_id}")],
+        [InlineKeyboardButton("✅ Подтвердить отмену", callback_data=callback_codec.encode("confirm_cancel", event_id))],
         [InlineKeyboardButton("🚫 Не отменять", callback_data="do_not_cancel_event")]
     ])
     await query.message.reply_text(f"Вы уверены, что хотите отменить событие '{event.get('game', 'Без названия')}'?",
@@ -682,7 +729,7 @@ async def cancel_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def confirm_cancel_event(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    event_id = query.data.split("_")[3]  # confirm_cancel_event_<event_id>
+    _, (event_id,) = callback_codec.decode(query.data)
 
     event = await EventCRUD.get(event_id)
     if not event:
@@ -693,16 +740,17 @@ async def confirm_cancel_event(update: Update, context: ContextTypes.DEFAULT_TYP
     if deleted:
         await query.message.edit_text(f"✅ Событие '{event.get('game', 'Без названия')}' отменено.")
         # Уведомляем участников
-        participants = event.get("participants", [])
+        participants = await UserCRUD.filter_active(event.get("participants", []))  # Без заблокировавших бота
         for participant_id in participants:
             if participant_id != event.get("creator_id"):  # Не уведомляем создателя
                 try:
                     await context.bot.send_message(
                         chat_id=participant_id,
-                        text=f"🚨 Внимание: Событие '{event.get('game', 'Без названия')}' (создатель: {event.get('creator_name', 'Неизвестен')}) было ОТМЕНЕНО."
+                        text=f"🚨 Внимание: Событие '{event.get('game', 'Без названия')}' (создатель: {event.get('creator_name', 'Неизвестен')}) было ОТМЕНЕНО.",
+                        rate_limit_args=REMINDER_LIMIT_ARGS  # Уведомление, а не ответ на нажатие
                     )
                 except Exception as e:
-                    print(f"Ошибка при уведомлении пользователя {participant_id} об отмене: {e}")
+                    await handle_send_error(e, participant_id, "уведомления об отмене")
     else:
         await query.message.edit_text("❌ Не удалось отменить событие.")
 
@@ -714,60 +762,72 @@ async def do_not_cancel_event(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 
 def register_handlers(application):
+    # Состояния диалогов сохраняются, если у приложения есть хранилище (database.persistence);
+    # брошенный диалог сбрасывается через CONVERSATION_TIMEOUT_HOURS
+    persistent = application.persistence is not None
+    conversation_timeout = Config.CONVERSATION_TIMEOUT_HOURS * 3600
+    # Шаги диалогов принимают только свои кнопки; остальные нажатия уходят в общий маршрутизатор
     conv_handler = ConversationHandler(
         entry_points=[MessageHandler(filters.Regex(r"^🎮 Создать событие$"), create_event)],
         states={
-            DATE: [CallbackQueryHandler(date_time_picker_handler)],
-            TIME: [CallbackQueryHandler(date_time_picker_handler)],
-            GAME: [CallbackQueryHandler(process_game_choice)],
+            DATE: [CallbackQueryHandler(date_time_picker_handler, pattern=router.matches("day", "month"))],
+            TIME: [CallbackQueryHandler(date_time_picker_handler, pattern=router.matches("time"))],
+            GAME: [CallbackQueryHandler(process_game_choice, pattern=router.matches("game"))],
             DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_description)],  # Новое состояние
             PARTICIPANT_LIMIT: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_participant_limit)],
             # Новое состояние
         },
         fallbacks=[MessageHandler(filters.Regex("^(Отмена|cancel)$"), cancel_creation)],
-        persistent=False,
+        persistent=persistent,
+        conversation_timeout=conversation_timeout,
         name="event_creation_conversation",
     )
 
     edit_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(edit_event_start, pattern=r"^edit_event_\w+$")],
+        entry_points=[CallbackQueryHandler(edit_event_start, pattern=router.matches("edit_event"))],
         states={
-            EDIT_CHOICE: [CallbackQueryHandler(edit_field_choice, pattern=r"^edit_field_\w+$")],
-            EDIT_DATE: [CallbackQueryHandler(edit_datetime_handler)],
-            EDIT_TIME: [CallbackQueryHandler(edit_datetime_handler)],  # Time handler is part of datetime flow
-            EDIT_GAME: [CallbackQueryHandler(edit_game_handler, pattern=r"^game_\w+$")],
+            EDIT_CHOICE: [CallbackQueryHandler(edit_field_choice, pattern=router.matches(*EDIT_FIELD_CALLBACKS))],
+            EDIT_DATE: [CallbackQueryHandler(edit_datetime_handler, pattern=router.matches("day", "month"))],
+            EDIT_TIME: [CallbackQueryHandler(edit_datetime_handler, pattern=router.matches("time"))],
+            EDIT_GAME: [CallbackQueryHandler(edit_game_handler, pattern=router.matches("game"))],
             EDIT_DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_description_handler)],
             EDIT_LIMIT: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_limit_handler)],
         },
-        fallbacks=[CallbackQueryHandler(edit_cancel, pattern="^edit_cancel$"),
+        fallbacks=[CallbackQueryHandler(edit_cancel, pattern=router.matches("edit_cancel")),
                    MessageHandler(filters.Regex("^(Отмена|cancel)$"), edit_cancel)],
-        persistent=False,
+        persistent=persistent,
+        conversation_timeout=conversation_timeout,
         name="event_edit_conversation",
     )
 
-    rating_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(request_rating, pattern=r"rate_event_\w+_\d+")],
-        states={
-            RATING: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_rating)],
-        },
-        fallbacks=[MessageHandler(filters.COMMAND, cancel_creation)],  # Можно добавить более конкретный fallback
-        persistent=False,
-        name="rating_conversation",
-    )
-
     application.add_handler(conv_handler)
     application.add_handler(edit_conv_handler)  # Регистрируем обработчик редактирования
-    application.add_handler(rating_conv_handler)  # Регистрируем обработчик для рейтинга
     application.add_handler(MessageHandler(filters.Regex(r"^👀 Активные события$"), active_events_handler))
     application.add_handler(
         MessageHandler(filters.Regex(r"^⚙️ Мои события$"), my_events))  # Добавляем обработчик для "Мои события"
 
-    application.add_handler(CallbackQueryHandler(join_event, pattern=r"join_\w+"))
-    application.add_handler(CallbackQueryHandler(event_details, pattern=r"info_\w+"))
+    # Фильтр событий по дате
+    application.add_handler(MessageHandler(filters.Regex(r"^🔍 Фильтр событий$"), show_event_filters))
+    application.add_handler(CommandHandler("filter", show_event_filters))
 
-    # Обработчики отмены
-    application.add_handler(CallbackQueryHandler(cancel_event, pattern=r"^cancel_event_\w+$"))
-    application.add_handler(CallbackQueryHandler(confirm_cancel_event, pattern=r"^confirm_cancel_event_\w+$"))
-    application.add_handler(CallbackQueryHandler(do_not_cancel_event, pattern=r"^do_not_cancel_event$"))
+    application.add_handler(CommandHandler("my_events", my_events))  # Команда /my_events также будет работать
 
-    application.add_handler(CommandHandler("my_events", my_events))  # Команда /my_events также будет работать
\ No newline at end of file
+    # Кнопки вне диалогов обрабатывает маршрутизатор (utils.router), его обработчик регистрируется в main.py
+    router.add("rate", rate_event)  # Оценка создателя
+    router.add_prefix("filter", apply_filter)  # filter_today, filter_week, ...
+    router.add("range_day", filter_range_handler)
+    router.add("range_month", filter_range_handler)
+
+    # Листание списков событий
+    router.add("page", events_page_handler)
+    router.add("my_events_past", my_events_switch)
+    router.add("my_events_upcoming", my_events_switch)
+
+    router.add("join", join_event)
+    router.add("info", event_details)
+    router.add("leave", leave_event)
+
+    # Обработчики отмены
+    router.add("cancel_event", cancel_event)
+    router.add("confirm_cancel", confirm_cancel_event)
+    router.add("do_not_cancel_event", do_not_cancel_event)
@@ -1,18 +1,69 @@
 from telegram import Update
+from telegram.helpers import escape_markdown
 from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
-from database.crud import RatingCRUD, UserCRUD # Импортируем UserCRUD для получения информации о пользователях
-from keyboards.builder import KeyboardBuilder # Если понадобится для оценки, но пока не используется
+from datetime import datetime, timedelta
+from database.crud import RatingCRUD, week_start
+from keyboards.builder import KeyboardBuilder, GAMES
+
+
+# Периоды для /top: название -> (сколько недель назад начинать, подпись)
+PERIODS = {
+    "week": (0, "за неделю"),
+    "неделя": (0, "за неделю"),
+    "month": (3, "за месяц"),
+    "месяц": (3, "за месяц"),
+}
+
+
+def parse_top_args(args: list):
+    """
+    Разбирает аргументы /top [игра] [неделя|месяц]. Возвращает (game, period) или None,
+    если игра не найдена в каталоге.
+    """
+    args = list(args or [])
+    period = None
+    if args and args[-1].lower() in PERIODS:
+        period = args.pop().lower()
+
+    game = None
+    if args:
+        name = " ".join(args).lower()
+        matches = [g for g in GAMES if g.lower() == name] or [g for g in GAMES if g.lower().startswith(name)]
+        if not matches:
+            return None
+        game = matches[0]
+    return game, period
 
 
 async def top_players(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # Получаем все средние рейтинги из базы данных
-    all_ratings = await RatingCRUD.get_all_average_ratings()
+    parsed = parse_top_args(context.args)
+    if parsed is None:
+        await update.message.reply_text(
+            "Игра не найдена. Использование: /top [игра] [неделя|месяц]\n"
+            f"Доступные игры: {', '.join(GAMES)}"
+        )
+        return
+    game, period = parsed
+
+    since = None
+    title_parts = []
+    if game:
+        title_parts.append(game)
+    if period:
+        weeks_back, period_title = PERIODS[period]
+        since = week_start(datetime.utcnow()) - timedelta(weeks=weeks_back)
+        title_parts.append(period_title)
+
+    # Общий топ читается из таблицы лидеров, топ по игре/периоду - из недельных корзин
+    all_ratings = await RatingCRUD.get_top_ratings(game=game, since=since)
 
     if not all_ratings:
         await update.message.reply_text("Нет данных для формирования рейтинга.")
         return
 
-    message_text = "⭐ **Топ игроков по рейтингу:**\n\n"
+    # Имена и названия игр экранируются: "_" в username ломает разметку Markdown
+    title_suffix = f" ({escape_markdown(', '.join(title_parts))})" if title_parts else ""
+    message_text = f"⭐ **Топ игроков по рейтингу{title_suffix}:**\n\n"
     rank = 1
     for player_data in all_ratings:
         user_id = player_data.get("user_id")
@@ -28,7 +79,7 @@ async def top_players(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             display_name = f"Пользователь {user_id}" # Запасной вариант
 
-        message_text += f"{rank}. {display_name}: {average_rating:.2f} ⭐\n"
+        message_text += f"{rank}. {escape_markdown(display_name)}: {average_rating:.2f} ⭐\n"
         rank += 1
 
     await update.message.reply_text(message_text, parse_mode="Markdown")
@@ -1,6 +1,7 @@
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup
-from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from telegram.ext import ContextTypes, CommandHandler
 from keyboards.builder import KeyboardBuilder
+from utils.router import router
 from database.crud import UserCRUD  # Импортируем UserCRUD для проверки существования пользователя
 
 
@@ -41,9 +42,12 @@ async def handle_start_callback(update: Update, context: ContextTypes.DEFAULT_TY
     # Добавляем пользователя в базу данных (или обновляем last_seen)
     await UserCRUD.add_user(user_id)
 
-    # Редактируем сообщение, чтобы убрать кнопку "Начать" и показать основное меню
-    await query.edit_message_text(
-        "👋 Добро пожаловать! Выберите действие:",
+    # Убираем кнопку "Начать". Основное меню - reply-клавиатура, ее можно
+    # прислать только новым сообщением (edit_message_text принимает лишь inline-клавиатуру)
+    await query.edit_message_text("👋 Добро пожаловать!")
+    await query.message.reply_text(
+        "Выберите действие. Чтобы получать уведомления о новых событиях, "
+        "отметьте интересные игры в разделе «🔔 Подписки».",
         reply_markup=KeyboardBuilder.main_menu()
     )
 
@@ -51,5 +55,5 @@ async def handle_start_callback(update: Update, context: ContextTypes.DEFAULT_TY
 def register_handlers(application):
     # CommandHandler для обработки прямого ввода /start
     application.add_handler(CommandHandler("start", start))
-    # CallbackQueryHandler для обработки нажатия на Inline-кнопку "Начать"
-    application.add_handler(CallbackQueryHandler(handle_start_callback, pattern="^start_command$"))
\ No newline at end of file
+    # Нажатие на Inline-кнопку "Начать" обрабатывает маршрутизатор callback-запросов
+    router.add("start_command", handle_start_callback)
\ No newline at end of file
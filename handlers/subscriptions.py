@@ -0,0 +1,72 @@
+from telegram import Update
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
+from config import Config
+from database.crud import UserCRUD, NOTIFY_DIGEST, NOTIFY_INSTANT
+from keyboards.builder import KeyboardBuilder, GAMES
+from utils import callback_codec
+from utils.router import router
+
+SUBSCRIPTIONS_TEXT = (
+    "🔔 Подписки на игры\n"
+    "Уведомления о новых событиях приходят только по отмеченным играм. "
+    "Нажмите на игру, чтобы подписаться или отписаться.\n"
+    "Нижняя кнопка переключает режим: сразу о каждом событии или одной сводкой "
+    f"раз в {Config.DIGEST_INTERVAL_HOURS:g} ч."
+)
+
+
+def _keyboard(settings: dict):
+    return KeyboardBuilder.subscriptions_keyboard(
+        settings["subscriptions"], settings["notify_mode"] == NOTIFY_DIGEST
+    )
+
+
+async def _refresh_keyboard(query, settings: dict):
+    try:
+        await query.edit_message_reply_markup(reply_markup=_keyboard(settings))
+    except BadRequest as e:
+        # Двойное нажатие: клавиатура уже в нужном состоянии
+        if "not modified" not in str(e).lower():
+            raise
+
+
+async def subscriptions_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    settings = await UserCRUD.get_notification_settings(update.effective_user.id)
+    await update.message.reply_text(SUBSCRIPTIONS_TEXT, reply_markup=_keyboard(settings))
+
+
+async def toggle_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    _, (index,) = callback_codec.decode(query.data)
+    if index >= len(GAMES):
+        await query.answer("Игра не найдена.")
+        return
+
+    game = GAMES[index]
+    settings = await UserCRUD.toggle_subscription(query.from_user.id, game)
+    subscribed = game in settings["subscriptions"]
+    await query.answer(f"🔔 Вы подписаны на {game}" if subscribed else f"🔕 Вы отписались от {game}")
+    await _refresh_keyboard(query, settings)
+
+
+async def toggle_notify_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    _, (digest,) = callback_codec.decode(query.data)
+    mode = NOTIFY_DIGEST if digest else NOTIFY_INSTANT
+    await UserCRUD.set_notify_mode(query.from_user.id, mode)
+    if digest:
+        await query.answer(f"📬 Новые события будут приходить сводкой раз в {Config.DIGEST_INTERVAL_HOURS:g} ч.")
+    else:
+        await query.answer("⚡ Новые события будут приходить сразу.")
+    settings = await UserCRUD.get_notification_settings(query.from_user.id)
+    await _refresh_keyboard(query, settings)
+
+
+def register_handlers(application):
+    # Команда /subscriptions и кнопка "🔔 Подписки" из главного меню
+    application.add_handler(CommandHandler("subscriptions", subscriptions_menu))
+    application.add_handler(MessageHandler(filters.Regex(r"^🔔 Подписки$"), subscriptions_menu))
+    # Переключатели подписок и режима уведомлений обрабатывает маршрутизатор callback-запросов
+    router.add("sub", toggle_subscription)
+    router.add("notify_mode", toggle_notify_mode)
@@ -1,25 +1,159 @@
 from telegram import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
-from datetime import datetime, timedelta
+from datetime import date, datetime
 import calendar  # Импортируем модуль calendar
+import functools
+from utils import callback_codec
+from utils.formatting import format_event_datetime
+
+# Каталог игр: используется при создании события, в топах по играм и подписках
+GAMES = ["Dota 2", "CS2", "Valorant", "League of Legends", "Minecraft", "Fortnite", "Apex Legends", "PUBG",
+         "Genshin Impact", "Другое"]
+
+
+def page_callback_data(kind: str, direction: str, event: dict) -> str:
+    """
+    callback_data кнопки листания: вид списка, направление (n|p) и курсор (datetime, _id)
+    крайнего события страницы, упакованные кодеком.
+    """
+    timestamp = calendar.timegm(event["datetime"].utctimetuple())
+    return callback_codec.encode("page", kind, 1 if direction == "p" else 0, timestamp, event["_id"])
+
+
+def parse_page_callback_data(data: str):
+    """
+    Разбирает callback_data кнопки листания. Возвращает (kind, direction, cursor).
+    """
+    _, (kind, direction, timestamp, event_id) = callback_codec.decode(data)
+    cursor = (datetime.utcfromtimestamp(timestamp), event_id)
+    return kind, "prev" if direction else "next", cursor
+
+
+def _build_main_menu() -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup([
+        ["🎮 Создать событие", "👀 Активные события"],
+        ["⚙️ Мои события", "⭐ Топ игроков"],
+        ["🔍 Фильтр событий", "🔔 Подписки"]
+    ], resize_keyboard=True)
+
+
+def _build_filter_menu() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("Сегодня", callback_data="filter_today"),
+            InlineKeyboardButton("Завтра", callback_data="filter_tomorrow"),
+            InlineKeyboardButton("Эта неделя", callback_data="filter_week")
+        ],
+        [
+            InlineKeyboardButton("Выходные", callback_data="filter_weekend"),
+            InlineKeyboardButton("Все", callback_data="filter_all"),
+            InlineKeyboardButton("📅 Период", callback_data="filter_custom")
+        ]
+    ])
+
+
+def _build_time_keyboard() -> InlineKeyboardMarkup:
+    keyboard = []
+    times = list(range(0, 24 * 60, 30))  # Минуты от начала суток, шаг в 30 минут
+
+    # Распределяем время по 4 кнопки в ряд
+    for i in range(0, len(times), 4):
+        row = []
+        for minutes in times[i:i + 4]:
+            time_slot = f"{minutes // 60:02d}:{minutes % 60:02d}"
+            row.append(InlineKeyboardButton(time_slot, callback_data=callback_codec.encode("time", minutes)))
+        keyboard.append(row)
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+def _build_game_choice_keyboard() -> InlineKeyboardMarkup:
+    keyboard = []
+
+    # Размещаем по 2 игры в ряд
+    for i in range(0, len(GAMES), 2):
+        row = []
+        # В callback_data передается индекс игры в GAMES, а не ее название
+        row.append(InlineKeyboardButton(GAMES[i], callback_data=callback_codec.encode("game", i)))
+        if i + 1 < len(GAMES):
+            row.append(InlineKeyboardButton(GAMES[i + 1], callback_data=callback_codec.encode("game", i + 1)))
+        keyboard.append(row)
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+@functools.lru_cache(maxsize=256)
+def _build_subscriptions_keyboard(subscribed: frozenset, digest: bool) -> InlineKeyboardMarkup:
+    keyboard = []
+    for i in range(0, len(GAMES), 2):
+        row = []
+        for index in range(i, min(i + 2, len(GAMES))):
+            mark = "✅" if GAMES[index] in subscribed else "▫️"
+            row.append(InlineKeyboardButton(f"{mark} {GAMES[index]}", callback_data=callback_codec.encode("sub", index)))
+        keyboard.append(row)
+    # Текущий режим уведомлений, нажатие переключает на другой
+    mode_text = "📬 Уведомления: сводкой" if digest else "⚡ Уведомления: сразу"
+    keyboard.append([InlineKeyboardButton(mode_text, callback_data=callback_codec.encode("notify_mode", int(not digest)))])
+    return InlineKeyboardMarkup(keyboard)
+
+
+@functools.lru_cache(maxsize=64)
+def _build_calendar(year: int, month: int, today: date, prefix: str) -> InlineKeyboardMarkup:
+    keyboard = []
+
+    # Заголовок с месяцем и годом
+    month_year_str = datetime(year, month, 1).strftime("%B %Y")
+    keyboard.append([InlineKeyboardButton(month_year_str, callback_data="ignore")])
+
+    # Дни недели, понедельник первый
+    days_of_week = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+    keyboard.append([InlineKeyboardButton(day, callback_data="ignore") for day in days_of_week])
+
+    # Выделяем текущий день, если показываем текущий месяц
+    today_day = today.day if (today.year, today.month) == (year, month) else -1
+
+    # Получаем календарь для месяца
+    cal = calendar.monthcalendar(year, month)
+    for week in cal:
+        row = []
+        for day in week:
+            if day == 0:  # Пустые дни в начале или конце месяца
+                row.append(InlineKeyboardButton(" ", callback_data="ignore"))
+            else:
+                button_text = f"*{day}*" if day == today_day else str(day)
+                row.append(InlineKeyboardButton(
+                    button_text, callback_data=callback_codec.encode(f"{prefix}day", year, month, day)
+                ))
+        keyboard.append(row)
+
+    # Кнопки для навигации по месяцам
+    keyboard.append([
+        InlineKeyboardButton("◀️", callback_data=callback_codec.encode(f"{prefix}month", year, month, -1)),
+        InlineKeyboardButton(" ", callback_data="ignore"),  # Пустая кнопка для центрирования
+        InlineKeyboardButton("▶️", callback_data=callback_codec.encode(f"{prefix}month", year, month, 1))
+    ])
+
+    return InlineKeyboardMarkup(keyboard)
+
+
+# Статичные клавиатуры строятся один раз: объекты telegram неизменяемы, их можно переиспользовать
+_MAIN_MENU = _build_main_menu()
+_FILTER_MENU = _build_filter_menu()
+_TIME_KEYBOARD = _build_time_keyboard()
+_GAME_CHOICE_KEYBOARD = _build_game_choice_keyboard()
+
+# Префиксы действий календаря: "" - создание/редактирование (day, month),
+# "range_" - выбор периода в фильтре (range_day, range_month)
+CALENDAR_PREFIXES = ("", "range_")
 
 
 class KeyboardBuilder:
     @staticmethod
     def main_menu():
-        return ReplyKeyboardMarkup([
-            ["🎮 Создать событие", "👀 Активные события"],
-            ["⚙️ Мои события", "⭐ Топ игроков"]
-        ], resize_keyboard=True)
+        return _MAIN_MENU
 
     @staticmethod
     def filter_menu():
-        return InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton("Сегодня", callback_data="filter_today"),
-                InlineKeyboardButton("Завтра", callback_data="filter_tomorrow"),
-                InlineKeyboardButton("Все", callback_data="filter_all")
-            ]
-        ])
+        return _FILTER_MENU
 
     @staticmethod
     def event_actions(event_id: str):
@@ -30,103 +164,83 @@ class KeyboardBuilder:
         """
         return InlineKeyboardMarkup([
             [
-                InlineKeyboardButton("Подробнее", callback_data=f"info_{event_id}")
+                InlineKeyboardButton("Подробнее", callback_data=callback_codec.encode("info", event_id))
             ]
         ])
 
     @staticmethod
-    def build_calendar(year: int, month: int) -> InlineKeyboardMarkup:
-        keyboard = []
-
-        # Заголовок с месяцем и годом
-        month_year_str = datetime(year, month, 1).strftime("%B %Y")
-        keyboard.append([InlineKeyboardButton(month_year_str, callback_data="ignore")])
-
-        # Дни недели, понедельник первый
-        days_of_week = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
-        keyboard.append([InlineKeyboardButton(day, callback_data="ignore") for day in days_of_week])
-
-        # Получаем календарь для месяца
-        cal = calendar.monthcalendar(year, month)
-        for week in cal:
-            row = []
-            for day in week:
-                if day == 0:  # Пустые дни в начале или конце месяца
-                    row.append(InlineKeyboardButton(" ", callback_data="ignore"))
-                else:
-                    # Опционально: выделить текущий день
-                    today = datetime.now().day if datetime.now().year == year and datetime.now().month == month else -1
-                    button_text = f"*{day}*" if day == today else str(day)
-                    row.append(InlineKeyboardButton(button_text, callback_data=f"day_{year}_{month}_{day}"))
-            keyboard.append(row)
-
-        # Кнопки для навигации по месяцам
-        keyboard.append([
-            InlineKeyboardButton("◀️", callback_data=f"prev_month_{year}_{month}"),
-            InlineKeyboardButton(" ", callback_data="ignore"),  # Пустая кнопка для центрирования
-            InlineKeyboardButton("▶️", callback_data=f"next_month_{year}_{month}")
-        ])
+    def build_calendar(year: int, month: int, prefix: str = "") -> InlineKeyboardMarkup:
+        """
+        Календарь на месяц. prefix добавляется к действиям дней и навигации
+        (day/month), чтобы один и тот же календарь можно было использовать в разных
+        сценариях (например, "range_" для выбора периода в фильтре).
+        Готовые календари кэшируются по (год, месяц, сегодняшняя дата, префикс).
+        """
+        return _build_calendar(year, month, date.today(), prefix)
 
-        return InlineKeyboardMarkup(keyboard)
+    @staticmethod
+    def warm_calendar_cache(months: int):
+        """
+        Заранее строит календари на текущий и следующие months месяцев.
+        """
+        today = date.today()
+        year, month = today.year, today.month
+        for _ in range(months + 1):
+            for prefix in CALENDAR_PREFIXES:
+                _build_calendar(year, month, today, prefix)
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
 
     @staticmethod
     def build_time_keyboard() -> InlineKeyboardMarkup:
-        keyboard = []
-        times = []
-        for hour in range(0, 24):
-            for minute in [0, 30]:  # Шаг в 30 минут
-                times.append(f"{hour:02d}:{minute:02d}")
-
-        # Распределяем время по 4 кнопки в ряд
-        for i in range(0, len(times), 4):
-            row = []
-            for time_slot in times[i:i + 4]:
-                row.append(InlineKeyboardButton(time_slot, callback_data=f"time_{time_slot}"))
-            keyboard.append(row)
-
-        return InlineKeyboardMarkup(keyboard)
+        return _TIME_KEYBOARD
 
     @staticmethod
     def build_game_choice_keyboard() -> InlineKeyboardMarkup:
-        # Обновленный, более общий список игр
-        games = ["Dota 2", "CS2", "Valorant", "League of Legends", "Minecraft", "Fortnite", "Apex Legends", "PUBG",
-                 "Genshin Impact", "Другое"]
-        keyboard = []
+        return _GAME_CHOICE_KEYBOARD
 
-        # Размещаем по 2 игры в ряд
-        for i in range(0, len(games), 2):
-            row = []
-            row.append(InlineKeyboardButton(games[i], callback_data=f"game_{games[i]}"))
-            if i + 1 < len(games):
-                row.append(InlineKeyboardButton(games[i + 1], callback_data=f"game_{games[i + 1]}"))
-            keyboard.append(row)
+    @staticmethod
+    def subscriptions_keyboard(subscriptions: list, digest: bool = False) -> InlineKeyboardMarkup:
+        """
+        Переключатели подписок на игры каталога GAMES (✅ - подписка есть)
+        и кнопка режима уведомлений. Клавиатуры кэшируются по набору подписок и режиму.
+        """
+        return _build_subscriptions_keyboard(frozenset(subscriptions), digest)
 
-        return InlineKeyboardMarkup(keyboard)
+    @staticmethod
+    def pagination_row(kind: str, events: list, has_prev: bool, has_next: bool) -> list:
+        """
+        Ряд кнопок "Назад"/"Вперед" для постраничного списка событий.
+        """
+        row = []
+        if events and has_prev:
+            row.append(InlineKeyboardButton("◀️ Назад", callback_data=page_callback_data(kind, "p", events[0])))
+        if events and has_next:
+            row.append(InlineKeyboardButton("Вперед ▶️", callback_data=page_callback_data(kind, "n", events[-1])))
+        return row
 
     @staticmethod
-    def active_events_list(events: list, user_id: int) -> InlineKeyboardMarkup:
+    def active_events_list(events: list, user_id: int, pagination: list = None) -> InlineKeyboardMarkup:
         """
         Создаёт inline-клавиатуру со списком событий.
         Каждое событие - кнопка с названием, описанием, датой/временем, количеством участников и создателем.
         Вторая кнопка 'Присоединиться', 'Вы участвуете' или 'Мест нет'.
+        pagination - ряд кнопок листания (см. pagination_row), добавляется в конец.
         """
         keyboard = []
         for event in events:
-            event_id = str(event["_id"])
+            info_data = callback_codec.encode("info", event["_id"])
             game = event.get("game", "Без названия")
-            datetime_str = event.get("datetime", "")
             creator = event.get("creator_name", "Неизвестен")
+            # Списки строятся по компактной проекции (participants_count, is_member),
+            # но поддерживаем и полные документы с массивом participants
             participants = event.get("participants", [])
-            count = len(participants)
+            count = event.get("participants_count", len(participants))
+            is_member = event.get("is_member", user_id in participants)
             description = event.get("description", "Нет описания")  # Новое поле
             limit = event.get("participant_limit", 0)  # Новое поле
 
             # Форматируем дату и время
-            try:
-                dt_object = datetime.fromisoformat(datetime_str)
-                formatted_datetime = dt_object.strftime("%d.%m.%Y %H:%M")
-            except ValueError:
-                formatted_datetime = datetime_str
+            formatted_datetime = format_event_datetime(event.get("datetime"))
 
             # Текст для отображения лимита
             limit_text = f" / {limit}" if limit > 0 else " / ∞"
@@ -141,34 +255,63 @@ class KeyboardBuilder:
             )
 
             # Добавляем кнопку с деталями события
-            keyboard.append([InlineKeyboardButton(text_button, callback_data=f"info_{event_id}")])
+            keyboard.append([InlineKeyboardButton(text_button, callback_data=info_data)])
 
             # Логика для кнопки присоединения/участия/нет мест
-            if user_id in participants:
+            if is_member:
                 keyboard.append(
-                    [InlineKeyboardButton(f"✅ Вы участвуете ({count}{limit_text})", callback_data=f"info_{event_id}")])
+                    [InlineKeyboardButton(f"✅ Вы участвуете ({count}{limit_text})", callback_data=info_data)])
             elif limit > 0 and count >= limit:  # Если есть лимит и он достигнут
                 keyboard.append(
-                    [InlineKeyboardButton(f"🚫 Мест нет ({count}{limit_text})", callback_data=f"info_{event_id}")])
+                    [InlineKeyboardButton(f"🚫 Мест нет ({count}{limit_text})", callback_data=info_data)])
             else:  # Если пользователь не участвует и есть места
                 keyboard.append(
-                    [InlineKeyboardButton(f"➕ Присоединиться ({count}{limit_text})", callback_data=f"join_{event_id}")])
+                    [InlineKeyboardButton(f"➕ Присоединиться ({count}{limit_text})",
+                                          callback_data=callback_codec.encode("join", event["_id"]))])
 
             # Добавляем разделитель для лучшей читаемости
             keyboard.append([InlineKeyboardButton("—" * 30, callback_data="ignore")])
 
+        if pagination:
+            keyboard.append(pagination)
+
+        return InlineKeyboardMarkup(keyboard)
+
+    @staticmethod
+    def my_events_list(events: list, pagination: list = None, past: bool = False) -> InlineKeyboardMarkup:
+        """
+        Клавиатура для списка 'Мои события': по одному ряду на событие.
+        Для созданных пользователем событий (role == "creator") в ряду есть кнопки
+        редактирования и отмены. Последний ряд переключает предстоящие/прошедшие события.
+        """
+        keyboard = []
+        for event in events:
+            event_id = event["_id"]
+            title = f"🎮 {event.get('game', 'Без названия')} · {format_event_datetime(event.get('datetime'))}"
+            row = [InlineKeyboardButton(title, callback_data=callback_codec.encode("info", event_id))]
+            if event.get("role") == "creator" and not past:
+                row.append(InlineKeyboardButton("✏️", callback_data=callback_codec.encode("edit_event", event_id)))
+                row.append(InlineKeyboardButton("🗑️", callback_data=callback_codec.encode("cancel_event", event_id)))
+            keyboard.append(row)
+
+        if pagination:
+            keyboard.append(pagination)
+
+        if past:
+            keyboard.append([InlineKeyboardButton("📅 Предстоящие", callback_data="my_events_upcoming")])
+        else:
+            keyboard.append([InlineKeyboardButton("📜 Прошедшие", callback_data="my_events_past")])
+
         return InlineKeyboardMarkup(keyboard)
 
     @staticmethod
     def build_rating_keyboard(event_id: str, creator_id: int) -> InlineKeyboardMarkup:
         """
         Создает inline-клавиатуру для оценки создателя события.
+        Количество звезд передается в callback_data, оценка ставится одним нажатием.
         """
         keyboard = [
-            [InlineKeyboardButton("1⭐", callback_data=f"rate_event_{event_id}_{creator_id}"),
-             InlineKeyboardButton("2⭐", callback_data=f"rate_event_{event_id}_{creator_id}"),
-             InlineKeyboardButton("3⭐", callback_data=f"rate_event_{event_id}_{creator_id}"),
-             InlineKeyboardButton("4⭐", callback_data=f"rate_event_{event_id}_{creator_id}"),
-             InlineKeyboardButton("5⭐", callback_data=f"rate_event_{event_id}_{creator_id}")]
+            [InlineKeyboardButton(f"{stars}⭐", callback_data=callback_codec.encode("rate", event_id, creator_id, stars))
+             for stars in range(1, 6)]
         ]
-        return InlineKeyboardMarkup(keyboard)
\ No newline at end of file
+        return InlineKeyboardMarkup(keyboard)
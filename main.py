@@ -1,11 +1,24 @@
 import logging
 import nest_asyncio
 import asyncio
-from telegram.ext import Application
+import signal
+from telegram import Update
+from telegram.ext import Application, TypeHandler
 
 from config import Config
-from handlers import start, events, ratings  # Убедитесь, что все хэндлеры импортированы
-from utils.scheduler import setup_scheduler
+from handlers import start, events, ratings, subscriptions  # Убедитесь, что все хэндлеры импортированы
+from utils.scheduler import setup_scheduler, stop_scheduler
+from utils.reminders import reminder_scheduler
+from utils.broadcast import broadcaster
+from database import init_db, close_db
+from database.crud import EventCRUD, ensure_indexes, rating_buffer
+from database.persistence import create_persistence
+from keyboards.builder import KeyboardBuilder
+from utils.router import router
+from utils.webhook import WebhookServer
+from utils.update_processor import PerChatUpdateProcessor
+from utils.outbound import PriorityRateLimiter
+from utils.activity import activity_tracker
 
 nest_asyncio.apply()
 
@@ -17,23 +30,105 @@ logging.basicConfig(
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
 
+async def post_init(app: Application):
+    # Единственный пул соединений с MongoDB открывается здесь, а не при импорте
+    await init_db()
+    await ensure_indexes()
+    # Загружаем предстоящие напоминания в память и запускаем таймер
+    await reminder_scheduler.start(app)
+    # Продолжаем рассылки, прерванные перезапуском
+    await broadcaster.start(app)
+    # Фоновый сброс буфера оценок
+    rating_buffer.start()
+    # Фоновая запись last_seen и профилей пользователей
+    activity_tracker.start()
+    # Календари на ближайшие месяцы строим заранее
+    KeyboardBuilder.warm_calendar_cache(Config.CALENDAR_PREFETCH_MONTHS)
+
+
+async def post_stop(app: Application):
+    # Фоновые отправки останавливаем до app.shutdown(): после него бот и ограничитель
+    # запросов уже закрыты, и каждая отправка рассылки падала бы как "ошибка доставки"
+    await stop_scheduler()
+    await reminder_scheduler.stop()
+    await broadcaster.stop()
+    await rating_buffer.stop()  # Записываем оставшиеся в буфере оценки
+    await activity_tracker.stop()
+
+
+async def post_shutdown(app: Application):
+    close_db()
+    router.log_stats()  # Время обработки callback-запросов по действиям
+    logging.info("Кэш событий: %s", EventCRUD.cache_stats())
+
+
+async def run_webhook(app: Application):
+    """
+    Режим webhook: жизненный цикл приложения ведем сами, так как обновления
+    принимает наш сервер (utils.webhook), а не Updater.
+    """
+    server = WebhookServer(app)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    await app.initialize()
+    await post_init(app)  # run_polling вызывает post_init сам, здесь - вручную
+    await app.start()
+    try:
+        await server.start()
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await app.stop()
+        await post_stop(app)  # run_polling вызывает post_stop сам
+        await app.shutdown()
+        await post_shutdown(app)
+
+
 async def main():
-    # Инициализация Persistence для сохранения состояний между перезапусками бота.
-    # Файл 'persistence.json' будет создан в корневой папке проекта.
-    persistence = None
+    # Состояния диалогов и user_data переживают перезапуск (Config.PERSISTENCE_BACKEND)
+    persistence = create_persistence()
+
+    app = (
+        Application.builder()
+        .token(Config.TELEGRAM_TOKEN)
+        .persistence(persistence)
+        # Разные чаты обрабатываются параллельно, обновления одного чата - по очереди
+        .concurrent_updates(PerChatUpdateProcessor(Config.MAX_CONCURRENT_UPDATES))
+        # Все исходящие запросы идут через общие приоритетные очереди (utils.outbound)
+        .rate_limiter(PriorityRateLimiter())
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
-    app = Application.builder().token(Config.TELEGRAM_TOKEN).persistence(persistence).build()
+    # Отметка активности и профиля по каждому обновлению, до всех остальных обработчиков
+    app.add_handler(TypeHandler(Update, activity_tracker.track), group=-1)
 
     # Порядок регистрации важен для некоторых обработчиков (например, start)
     start.register_handlers(app)
     events.register_handlers(app)
     ratings.register_handlers(app)
+    subscriptions.register_handlers(app)
+    # Один обработчик для всех inline-кнопок вне диалогов, после ConversationHandler'ов
+    app.add_handler(router.handler())
 
     # Установка планировщика задач для напоминаний о событиях
     setup_scheduler(app)
 
-    # Запускаем бота. run_polling() сама вызывает app.initialize() при использовании persistence.
-    await app.run_polling()
+    if Config.RUN_MODE == "webhook":
+        await run_webhook(app)
+    else:
+        # Запускаем бота. run_polling() сама вызывает app.initialize() при использовании persistence.
+        # Перед началом опроса она удаляет вебхук, не сбрасывая накопленные обновления,
+        # поэтому переключение из режима webhook обратно в polling ничего не теряет.
+        await app.run_polling()
 
 
 if __name__ == "__main__":
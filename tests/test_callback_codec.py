@@ -0,0 +1,101 @@
+"""
+Тесты кодека callback_data (utils.callback_codec).
+
+Запуск из корня проекта: python -m pytest tests
+"""
+import base64
+import os
+import random
+
+import pytest
+from bson import ObjectId
+
+from utils import callback_codec
+from utils.callback_codec import ACTIONS, CallbackDataError
+from utils.router import router
+
+# Ограничение Telegram на callback_data
+MAX_CALLBACK_DATA_BYTES = 64
+
+# Крайние значения аргументов: самые длинные varint из тех, что реально встречаются
+# (user_id до 2^52, timestamp), и самые длинные строки (вид списка, фильтр)
+EDGE_VALUES = {
+    "u": [0, 1, 127, 128, 2 ** 35],
+    "i": [0, -1, 1, -2 ** 52, 2 ** 52],
+    "s": ["a", "upcoming", "игра"],
+}
+
+
+def _random_args(rng: random.Random, schema: str) -> tuple:
+    args = []
+    for kind in schema:
+        if kind == "o":
+            args.append(ObjectId(bytes(rng.randrange(256) for _ in range(12))))
+        else:
+            args.append(rng.choice(EDGE_VALUES[kind]))
+    return tuple(args)
+
+
+@pytest.mark.parametrize("action", sorted(ACTIONS))
+def test_round_trip_every_action(action):
+    rng = random.Random(action)
+    schema = ACTIONS[action][1]
+    for _ in range(200):
+        args = _random_args(rng, schema)
+        data = callback_codec.encode(action, *args)
+        assert callback_codec.decode(data) == (action, args)
+
+
+@pytest.mark.parametrize("action", sorted(ACTIONS))
+def test_encoded_length_fits_telegram_limit(action):
+    # Самые длинные значения каждого типа одновременно
+    longest = {"o": ObjectId(), "u": max(EDGE_VALUES["u"]), "i": min(EDGE_VALUES["i"]),
+               "s": max(EDGE_VALUES["s"], key=lambda s: len(s.encode()))}
+    data = callback_codec.encode(action, *(longest[kind] for kind in ACTIONS[action][1]))
+    assert data.startswith("A")
+    assert len(data.encode()) <= MAX_CALLBACK_DATA_BYTES
+
+
+@pytest.mark.parametrize("action", sorted(ACTIONS))
+def test_truncated_data_is_rejected(action):
+    rng = random.Random(action)
+    data = callback_codec.encode(action, *_random_args(rng, ACTIONS[action][1]))
+    for end in range(len(data)):
+        with pytest.raises(CallbackDataError):
+            callback_codec.decode(data[:end])
+
+
+def test_random_input_raises_only_codec_error():
+    rng = random.Random(1)
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_=+/ "
+    samples = ["", "A", "AQ", "ignore", "filter_today", "A" * 64, None, 42]
+    samples += ["A" + "".join(rng.choice(alphabet) for _ in range(rng.randrange(64))) for _ in range(2000)]
+    # Правильный base64 со случайными байтами после версии
+    samples += [
+        base64.urlsafe_b64encode(bytes([1]) + os.urandom(rng.randrange(40))).rstrip(b"=").decode()
+        for _ in range(2000)
+    ]
+    for data in samples:
+        try:
+            action, args = callback_codec.decode(data)
+        except CallbackDataError:
+            continue
+        # Случайные байты могут оказаться корректными данными (в том числе в неканонической
+        # записи base64 или varint) - тогда результат должен кодироваться обратно
+        assert callback_codec.decode(callback_codec.encode(action, *args)) == (action, args)
+
+
+def test_unknown_action_and_wrong_arity():
+    with pytest.raises(CallbackDataError):
+        callback_codec.encode("no_such_action")
+    with pytest.raises(CallbackDataError):
+        callback_codec.encode("info")
+    with pytest.raises(CallbackDataError):
+        callback_codec.encode("time", -1)
+
+
+def test_router_matches_ignores_plain_strings():
+    check = router.matches("join")
+    assert check(callback_codec.encode("join", ObjectId()))
+    assert not check(callback_codec.encode("leave", ObjectId()))
+    assert not check("filter_today")
@@ -0,0 +1,86 @@
+"""
+Учет активности и профилей пользователей.
+
+ActivityTracker подключается в main.py как TypeHandler в группе -1, поэтому видит
+каждое обновление до остальных обработчиков. Сам обработчик в базу не ходит:
+username, first_name и last_seen складываются в словарь в памяти (по пользователю
+хранится только последнее состояние) и раз в ACTIVITY_FLUSH_INTERVAL секунд
+записываются одним неупорядоченным bulk_write (UserCRUD.apply_activity).
+Записываются только пользователи, уже нажавшие /start: остальные в users не попадают.
+"""
+import asyncio
+from datetime import datetime
+
+from telegram import ChatMember, Update
+from telegram.ext import ContextTypes
+
+from config import Config
+from database.crud import UserCRUD
+
+
+class ActivityTracker:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pending = {}  # user_id -> поля для $set
+        self._lock = asyncio.Lock()
+        self._task = None
+        self.flushed = 0
+
+    async def track(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        if user is None or user.is_bot:
+            return
+
+        fields = {
+            "username": user.username,
+            "first_name": user.first_name,
+            "last_seen": datetime.utcnow(),
+            "inactive": False,
+        }
+        member_update = update.my_chat_member
+        if member_update is not None and member_update.chat.type == "private":
+            # Пользователь заблокировал бота: это не активность, рассылки ему больше не нужны
+            if member_update.new_chat_member.status == ChatMember.BANNED:
+                fields["inactive"] = True
+                fields["inactive_since"] = fields.pop("last_seen")
+
+        self._pending.setdefault(user.id, {}).update(fields)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            task, self._task = self._task, None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Ошибка при записи активности пользователей: {e}")
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await UserCRUD.apply_activity(batch)
+            except Exception:
+                # Более свежие поля, пришедшие во время записи, не затираем
+                for user_id, fields in batch.items():
+                    self._pending[user_id] = {**fields, **self._pending.get(user_id, {})}
+                raise
+            self.flushed += len(batch)
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "flushed": self.flushed}
+
+
+activity_tracker = ActivityTracker(Config.ACTIVITY_FLUSH_INTERVAL)
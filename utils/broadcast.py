@@ -0,0 +1,136 @@
+import asyncio
+import logging
+
+from telegram.ext import Application
+
+from config import Config
+from database.crud import EventCRUD, UserCRUD, BroadcastCRUD
+from keyboards.builder import KeyboardBuilder
+from utils.outbound import BROADCAST_LIMIT_ARGS, handle_send_error
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcaster:
+    """
+    Фоновая рассылка уведомлений о новых событиях.
+
+    Получатели (подписчики игры события, кроме получающих сводки) читаются курсором
+    по возрастанию user_id пачками, каждая пачка отправляется с ограниченной
+    параллельностью. Темп, повторы после RetryAfter и уступку интерактивным
+    ответам обеспечивает общий PriorityRateLimiter (utils.outbound). После каждой пачки прогресс
+    сохраняется в коллекции broadcasts, поэтому после перезапуска рассылка продолжается
+    с места остановки, а не начинается заново.
+    """
+
+    def __init__(self):
+        self._semaphore = asyncio.Semaphore(Config.BROADCAST_CONCURRENCY)
+        self._tasks = set()
+        self._app = None
+
+    async def start(self, app: Application):
+        """
+        Возобновляет рассылки, не завершенные до перезапуска. Рассылки по уже удаленным
+        событиям не возобновляются, а сразу помечаются завершенными.
+        """
+        self._app = app
+        for broadcast in await BroadcastCRUD.list_unfinished():
+            if await EventCRUD.get(broadcast["event_id"]) is None:
+                logger.info("Рассылка %s не возобновлена: событие %s удалено", broadcast["_id"], broadcast["event_id"])
+                await BroadcastCRUD.finish(str(broadcast["_id"]))
+                continue
+            logger.info("Возобновляем рассылку %s с user_id > %s", broadcast["_id"], broadcast.get("last_user_id"))
+            self._spawn(broadcast)
+
+    async def stop(self):
+        """
+        Прерывает рассылки и дожидается их завершения. Вызывается из post_stop, пока бот
+        и ограничитель еще работают: прогресс сохранен по последней полностью отправленной пачке.
+        """
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def submit(self, app: Application, event_id: str, text: str, exclude_user_id: int = None,
+                     game: str = None):
+        """
+        Ставит рассылку в фон и сразу возвращает управление обработчику.
+        Если указана игра, уведомление получают только ее подписчики.
+        """
+        self._app = app
+        broadcast_id = await BroadcastCRUD.create(event_id, text, exclude_user_id, game)
+        self._spawn({
+            "_id": broadcast_id,
+            "event_id": event_id,
+            "text": text,
+            "game": game,
+            "exclude_user_id": exclude_user_id,
+            "last_user_id": None,
+            "sent": 0,
+            "failed": 0,
+        })
+        return broadcast_id
+
+    def _spawn(self, broadcast: dict):
+        task = asyncio.create_task(self._run(broadcast))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, broadcast: dict):
+        broadcast_id = str(broadcast["_id"])
+        reply_markup = KeyboardBuilder.event_actions(broadcast["event_id"])
+        stats = {"sent": broadcast.get("sent", 0), "failed": broadcast.get("failed", 0)}
+
+        batch = []
+        try:
+            recipients = UserCRUD.iter_user_ids(
+                after=broadcast.get("last_user_id"), game=broadcast.get("game"), exclude_digest=True
+            )
+            async for user_id in recipients:
+                if user_id == broadcast.get("exclude_user_id"):
+                    continue
+                batch.append(user_id)
+                if len(batch) >= Config.BROADCAST_BATCH_SIZE:
+                    await self._send_batch(batch, broadcast["text"], reply_markup, stats)
+                    await BroadcastCRUD.checkpoint(broadcast_id, batch[-1], stats["sent"], stats["failed"])
+                    batch = []
+
+            if batch:
+                await self._send_batch(batch, broadcast["text"], reply_markup, stats)
+                await BroadcastCRUD.checkpoint(broadcast_id, batch[-1], stats["sent"], stats["failed"])
+
+            await BroadcastCRUD.finish(broadcast_id)
+            logger.info("Рассылка %s завершена: отправлено %s, ошибок %s", broadcast_id, stats["sent"], stats["failed"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Ошибка при выполнении рассылки %s: %s", broadcast_id, e)
+
+    async def _send_batch(self, batch: list, text: str, reply_markup, stats: dict):
+        """
+        Отправляет пачку. Ошибка, не относящаяся к доставке (например, бот останавливается),
+        пробрасывается после завершения всех отправок пачки: такую пачку нельзя отмечать
+        в checkpoint, при возобновлении она будет отправлена заново.
+        """
+        results = await asyncio.gather(
+            *(self._send_one(user_id, text, reply_markup) for user_id in batch), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        for ok in results:
+            stats["sent" if ok else "failed"] += 1
+
+    async def _send_one(self, user_id: int, text: str, reply_markup) -> bool:
+        async with self._semaphore:
+            try:
+                await self._app.bot.send_message(chat_id=user_id, text=text, reply_markup=reply_markup,
+                                                 rate_limit_args=BROADCAST_LIMIT_ARGS)
+                return True
+            except Exception as e:
+                await handle_send_error(e, user_id, "уведомления")
+                return False
+
+
+broadcaster = Broadcaster()
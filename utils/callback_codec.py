@@ -0,0 +1,159 @@
+"""
+Компактный кодек callback_data.
+
+Telegram ограничивает callback_data 64 байтами, а строки вида
+"confirm_cancel_event_<24 hex>" почти упираются в этот лимит. Кодек упаковывает
+версию, номер действия и аргументы в байты и кодирует их в base64url без паддинга:
+
+    [версия: 1 байт][действие: 1 байт][аргументы...]
+
+Типы аргументов (схема задается строкой в ACTIONS):
+    o - ObjectId (12 байт)
+    u - неотрицательное целое (varint)
+    i - целое со знаком (zigzag + varint), например user_id или смещение
+    s - короткая строка UTF-8 (длина 1 байт + байты)
+
+Статичные callback_data без параметров ("ignore", "filter_today" и т.п.) остаются
+обычными строками: закодированные данные всегда начинаются с символа "A" (версия 1),
+поэтому они не пересекаются.
+"""
+import base64
+import functools
+
+from bson import ObjectId
+
+VERSION = 1
+
+# Действие -> (номер, схема аргументов). Номера не переиспользуются: старые кнопки
+# в чатах должны либо корректно декодироваться, либо отклоняться.
+ACTIONS = {
+    "info": (1, "o"),
+    "join": (2, "o"),
+    "leave": (3, "o"),
+    "edit_event": (4, "o"),
+    "cancel_event": (5, "o"),
+    "confirm_cancel": (6, "o"),
+    "rate": (7, "oiu"),  # событие, создатель, звезды
+    "page": (8, "suuo"),  # вид списка, направление (0 - вперед, 1 - назад), timestamp, событие
+    "day": (9, "uuu"),  # год, месяц, день
+    "month": (10, "uui"),  # год, месяц, сдвиг (-1 / +1)
+    "range_day": (11, "uuu"),
+    "range_month": (12, "uui"),
+    "time": (13, "u"),  # минуты от начала суток
+    "game": (14, "u"),  # индекс в каталоге GAMES
+    "sub": (15, "u"),  # подписка на игру: индекс в каталоге GAMES
+    "notify_mode": (16, "u"),  # 0 - сразу, 1 - сводкой
+}
+
+_ACTIONS_BY_ID = {action_id: (name, schema) for name, (action_id, schema) in ACTIONS.items()}
+
+
+class CallbackDataError(ValueError):
+    """
+    callback_data не является корректной закодированной строкой.
+    """
+
+
+def _write_varint(out: bytearray, value: int):
+    if value < 0:
+        raise CallbackDataError("varint не может быть отрицательным")
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data: bytes, pos: int):
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data) or shift > 63:
+            raise CallbackDataError("обрезанный varint")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode(action: str, *args) -> str:
+    """
+    Кодирует действие и аргументы в строку для callback_data.
+    """
+    try:
+        action_id, schema = ACTIONS[action]
+    except KeyError:
+        raise CallbackDataError(f"неизвестное действие: {action}")
+    if len(args) != len(schema):
+        raise CallbackDataError(f"{action}: ожидается {len(schema)} аргументов, передано {len(args)}")
+
+    out = bytearray((VERSION, action_id))
+    for kind, value in zip(schema, args):
+        if kind == "o":
+            out += ObjectId(value).binary
+        elif kind == "u":
+            _write_varint(out, int(value))
+        elif kind == "i":
+            value = int(value)
+            _write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+        elif kind == "s":
+            raw = str(value).encode("utf-8")
+            if len(raw) > 255:
+                raise CallbackDataError("строка слишком длинная")
+            out.append(len(raw))
+            out += raw
+
+    return base64.urlsafe_b64encode(bytes(out)).rstrip(b"=").decode("ascii")
+
+
+@functools.lru_cache(maxsize=4096)
+def decode(data: str):
+    """
+    Декодирует callback_data. Возвращает (action, args) или бросает CallbackDataError.
+    Результат кэшируется, поэтому повторные проверки одной и той же строки бесплатны.
+    """
+    if not isinstance(data, str) or not data.startswith("A"):
+        raise CallbackDataError("не закодированная строка")
+    try:
+        raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    except (ValueError, TypeError):
+        raise CallbackDataError("некорректный base64")
+    if len(raw) < 2 or raw[0] != VERSION:
+        raise CallbackDataError("неподдерживаемая версия")
+    try:
+        action, schema = _ACTIONS_BY_ID[raw[1]]
+    except KeyError:
+        raise CallbackDataError("неизвестное действие")
+
+    args = []
+    pos = 2
+    for kind in schema:
+        if kind == "o":
+            if pos + 12 > len(raw):
+                raise CallbackDataError("обрезанный ObjectId")
+            args.append(ObjectId(raw[pos:pos + 12]))
+            pos += 12
+        elif kind == "u":
+            value, pos = _read_varint(raw, pos)
+            args.append(value)
+        elif kind == "i":
+            value, pos = _read_varint(raw, pos)
+            args.append((value >> 1) if not value & 1 else -((value + 1) >> 1))
+        elif kind == "s":
+            if pos >= len(raw) or pos + 1 + raw[pos] > len(raw):
+                raise CallbackDataError("обрезанная строка")
+            length = raw[pos]
+            try:
+                args.append(raw[pos + 1:pos + 1 + length].decode("utf-8"))
+            except UnicodeDecodeError:
+                raise CallbackDataError("некорректная строка")
+            pos += 1 + length
+
+    if pos != len(raw):
+        raise CallbackDataError("лишние байты")
+    return action, tuple(args)
@@ -0,0 +1,11 @@
+from datetime import datetime
+
+
+def format_event_datetime(value) -> str:
+    """
+    Форматирует дату события для показа пользователю.
+    Даты хранятся в базе как BSON date и приходят из CRUD уже объектами datetime.
+    """
+    if isinstance(value, datetime):
+        return value.strftime("%d.%m.%Y %H:%M")
+    return str(value or "")
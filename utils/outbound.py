@@ -0,0 +1,283 @@
+"""
+Общий планировщик исходящих запросов к Telegram.
+
+Все запросы бота проходят через PriorityRateLimiter (подключается в main.py через
+Application.builder().rate_limiter(...)). Запросы ждут в очередях по приоритету
+и выпускаются общим token bucket: ответы пользователям идут первыми, затем
+напоминания и уведомления, затем рассылки. Приоритет передается через rate_limit_args:
+
+    await bot.send_message(chat_id, text, rate_limit_args=BROADCAST_LIMIT_ARGS)
+
+Без rate_limit_args запрос считается интерактивным.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+
+from config import Config
+from database.crud import UserCRUD
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_REMINDER = 1
+PRIORITY_BROADCAST = 2
+
+QUEUE_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_REMINDER: "reminders",
+    PRIORITY_BROADCAST: "broadcasts",
+}
+
+REMINDER_LIMIT_ARGS = {"priority": PRIORITY_REMINDER}
+BROADCAST_LIMIT_ARGS = {"priority": PRIORITY_BROADCAST}
+
+# Служебные запросы не расходуют лимит на сообщения и не должны ждать в очереди
+UNLIMITED_ENDPOINTS = frozenset({
+    "getUpdates", "getMe", "setWebhook", "deleteWebhook", "getWebhookInfo", "answerCallbackQuery",
+})
+
+
+class OutboundClosedError(RuntimeError):
+    """
+    Ограничитель уже остановлен (бот завершает работу): запрос не отправлен.
+    Это не ошибка доставки конкретному пользователю - рассылки должны прерваться,
+    не отмечая получателя как обработанного.
+    """
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def is_dead_chat_error(error: Exception) -> bool:
+    """
+    Ошибка означает, что в этот чат писать бесполезно: бот заблокирован,
+    пользователь удален или чат не найден.
+    """
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and "chat not found" in str(error).lower()
+
+
+async def handle_send_error(error: Exception, chat_id: int, what: str) -> bool:
+    """
+    Разбирает ошибку отправки сообщения what пользователю chat_id. Ошибка Telegram - это
+    недоставка именно этому пользователю: она пишется в журнал, а заблокировавший бота
+    пользователь помечается inactive. Остальные ошибки (OutboundClosedError при остановке,
+    сбой кода) к пользователю не относятся и пробрасываются: получателя нельзя считать обработанным.
+
+    Возвращает True, если писать в чат бесполезно (повторять не нужно), и False для
+    прочих ошибок Telegram, после которых отправку можно повторить.
+    """
+    if not isinstance(error, TelegramError):
+        raise error
+    if is_dead_chat_error(error):
+        # Бот заблокирован: следующие рассылки этого пользователя пропустят
+        await UserCRUD.mark_inactive(chat_id)
+        return True
+    logger.warning("Ошибка при отправке %s пользователю %s: %s", what, chat_id, error)
+    return False
+
+
+class TokenBucket:
+    """
+    Token bucket: пропускает не более rate запросов в секунду с допустимым всплеском capacity.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """
+        Приостанавливает выдачу токенов (например, после RetryAfter от Telegram).
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PerChatLimiter:
+    """
+    Гарантирует минимальный интервал между сообщениями в один и тот же чат.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._last_sent = {}
+
+    async def acquire(self, chat_id: int):
+        # Слот резервируется до ожидания: одновременные отправки в один чат
+        # получают последовательные слоты, а не выходят вместе
+        now = time.monotonic()
+        slot = max(now, self._last_sent.get(chat_id, 0.0) + self.interval)
+        self._last_sent[chat_id] = slot
+
+        # Не даем словарю расти бесконечно (зарезервированные слоты в будущем остаются)
+        if len(self._last_sent) > 10000:
+            threshold = now - self.interval
+            self._last_sent = {k: v for k, v in self._last_sent.items() if v > threshold}
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def mark(self, chat_id: int):
+        """
+        Отмечает отправку без ожидания (ответ пользователю): следующие фоновые
+        сообщения в этот чат выдержат интервал уже от нее.
+        """
+        now = time.monotonic()
+        self._last_sent[chat_id] = max(now, self._last_sent.get(chat_id, 0.0))
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """
+    Ограничитель исходящих запросов с приоритетными очередями.
+
+    Каждый запрос встает в min-кучу (приоритет, порядковый номер). Один фоновый цикл
+    берет токен из общего bucket и выпускает самый приоритетный запрос, поэтому
+    при рассылке ответы пользователям не ждут в хвосте очереди. Фоновые сообщения
+    (напоминания, рассылки) дополнительно не чаще одного в per_chat_interval на чат.
+    На RetryAfter весь поток приостанавливается на указанное Telegram время,
+    и запрос повторяется до max_retries раз.
+    """
+
+    def __init__(self, rate: float = None, per_chat_interval: float = None, max_retries: int = None):
+        self.bucket = TokenBucket(rate if rate is not None else Config.OUTBOUND_RATE)
+        self.per_chat = PerChatLimiter(
+            per_chat_interval if per_chat_interval is not None else Config.OUTBOUND_PER_CHAT_INTERVAL
+        )
+        self.max_retries = max_retries if max_retries is not None else Config.OUTBOUND_MAX_RETRIES
+        self._heap = []  # (приоритет, порядковый номер, future)
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self._closed = False
+        self._stats = {
+            priority: {"depth": 0, "sent": 0, "retries": 0, "waited": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for priority in QUEUE_NAMES
+        }
+
+    async def initialize(self):
+        self._closed = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self):
+        self._closed = True
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        # Бот останавливается: ожидающие в очереди запросы уже не будут отправлены
+        for _, _, future in self._heap:
+            if not future.done():
+                future.set_exception(OutboundClosedError("ограничитель остановлен"))
+        self._heap.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if self._closed:
+            raise OutboundClosedError("ограничитель остановлен")
+        if endpoint in UNLIMITED_ENDPOINTS or self._task is None:
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_INTERACTIVE)
+        if priority not in QUEUE_NAMES:
+            priority = PRIORITY_INTERACTIVE
+        stats = self._stats[priority]
+        chat_id = data.get("chat_id")
+
+        for attempt in range(self.max_retries + 1):
+            await self._wait_turn(priority)
+            # Интервал на чат выдерживается после выхода из очереди, прямо перед отправкой:
+            # слот, занятый до долгого ожидания в очереди, не дал бы разнести сообщения во времени
+            if chat_id is not None:
+                if priority == PRIORITY_INTERACTIVE:
+                    self.per_chat.mark(chat_id)
+                else:
+                    await self.per_chat.acquire(chat_id)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                # Флуд-контроль: притормаживаем все очереди и повторяем попытку
+                stats["retries"] += 1
+                self.bucket.pause(retry_after_seconds(e))
+                if attempt == self.max_retries:
+                    raise
+                continue
+            stats["sent"] += 1
+            return result
+
+    async def _wait_turn(self, priority: int):
+        stats = self._stats[priority]
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        stats["depth"] += 1
+        self._wakeup.set()
+        started = time.monotonic()
+        try:
+            await future
+        finally:
+            stats["depth"] -= 1
+            waited = time.monotonic() - started
+            stats["waited"] += 1
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            await self.bucket.acquire()
+            # Вершину кучи берем после получения токена: за это время мог прийти более срочный запрос
+            while self._heap:
+                _, _, future = heapq.heappop(self._heap)
+                if not future.done():  # Отмененные ожидания пропускаем
+                    future.set_result(None)
+                    break
+
+    def stats(self) -> dict:
+        """
+        Метрики по очередям: глубина, отправлено, повторы после RetryAfter,
+        среднее и максимальное время ожидания в очереди.
+        """
+        result = {}
+        for priority, name in QUEUE_NAMES.items():
+            stats = self._stats[priority]
+            result[name] = {
+                "depth": stats["depth"],
+                "sent": stats["sent"],
+                "retries": stats["retries"],
+                "avg_wait_ms": stats["wait_total"] / stats["waited"] * 1000 if stats["waited"] else 0.0,
+                "max_wait_ms": stats["wait_max"] * 1000,
+            }
+        return result
@@ -0,0 +1,217 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime, timedelta
+
+from telegram.ext import Application
+
+from config import Config
+from database.crud import EventCRUD, UserCRUD
+from utils.formatting import format_event_datetime
+from utils.outbound import REMINDER_LIMIT_ARGS, handle_send_error
+
+logger = logging.getLogger(__name__)
+
+
+def _format_time_left(left: timedelta) -> str:
+    """
+    Оставшееся до начала время: "1 дн. 2 ч.", "1 ч. 30 мин.", "25 мин.".
+    """
+    minutes = max(1, round(left.total_seconds() / 60))
+    days, minutes = divmod(minutes, 1440)
+    hours, minutes = divmod(minutes, 60)
+    parts = []
+    if days:
+        parts.append(f"{days} дн.")
+    if hours:
+        parts.append(f"{hours} ч.")
+    if minutes and not days:
+        parts.append(f"{minutes} мин.")
+    return " ".join(parts)
+
+
+class ReminderScheduler:
+    """
+    Точный планировщик напоминаний о событиях.
+
+    Ближайшие напоминания хранятся в min-куче по времени срабатывания. Куча заполняется
+    одним курсором при старте и дальше поддерживается через подписку на EventCRUD
+    (create, update_event, delete_event), поэтому периодический опрос базы не нужен.
+    Устаревшие записи (после изменения или удаления события) не удаляются из кучи,
+    а пропускаются при извлечении по номеру версии. Версия события хранится, только пока
+    в куче есть ее записи: после последнего напоминания она удаляется.
+    """
+
+    def __init__(self):
+        self._heap = []  # (fire_at, seq, event_id, offset, skipped, version)
+        self._seq = itertools.count()
+        self._version_seq = itertools.count(1)  # Версии не повторяются и после удаления записи из _versions
+        self._versions = {}  # event_id -> [актуальная версия расписания, сколько ее записей в куче]
+        self._wakeup = None
+        self._task = None
+        self._fire_tasks = set()
+        self._app = None
+
+    async def start(self, app: Application):
+        self._app = app
+        self._wakeup = asyncio.Event()
+
+        now = datetime.utcnow()
+        loaded = 0
+        async for event in EventCRUD.iter_upcoming(now):
+            self._schedule(event, now)
+            loaded += 1
+        logger.info("Планировщик напоминаний: загружено %s событий, %s напоминаний", loaded, len(self._heap))
+
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = list(self._fire_tasks)
+        if self._task:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # --- Подписка на изменения EventCRUD ---
+
+    def on_event_saved(self, event: dict):
+        self._schedule(event, datetime.utcnow())
+
+    def on_event_deleted(self, event_id: str):
+        # Записи в куче станут устаревшими и будут пропущены
+        self._versions.pop(event_id, None)
+
+    # --- Внутренняя логика ---
+
+    def _schedule(self, event: dict, now: datetime):
+        event_id = str(event["_id"])
+        # Прежние записи события в куче становятся устаревшими
+        self._versions.pop(event_id, None)
+        version = next(self._version_seq)
+
+        start = event.get("datetime")
+        if not isinstance(start, datetime) or start <= now:
+            return
+
+        offsets = event.get("reminder_offsets") or Config.REMINDER_OFFSETS
+        sent = set(event.get("reminders_sent", []))
+        entries = []
+        missed = []
+        for offset in offsets:
+            if offset in sent:
+                continue
+            fire_at = start - timedelta(minutes=offset)
+            if fire_at > now:
+                entries.append((fire_at, offset, ()))
+            else:
+                missed.append(offset)
+
+        # Из пропущенных (простой, событие создано незадолго до начала) отправляем только самое
+        # близкое к началу, остальные помечаем отправленными. Если уже ушло более близкое
+        # напоминание, пропущенные устарели целиком.
+        if missed:
+            missed.sort()
+            fire = missed[0]
+            if sent and fire > min(sent):
+                fire = None
+            skipped = tuple(offset for offset in missed if offset != fire)
+            entries.append((now, fire, skipped))
+
+        if not entries:
+            return
+        self._versions[event_id] = [version, len(entries)]
+        for fire_at, offset, skipped in entries:
+            heapq.heappush(self._heap, (fire_at, next(self._seq), event_id, offset, skipped, version))
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            fire_at, _, event_id, offset, skipped, version = self._heap[0]
+            delay = (fire_at - datetime.utcnow()).total_seconds()
+            if delay > 0:
+                # Ждем либо наступления времени, либо появления более раннего напоминания
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            heapq.heappop(self._heap)
+            current = self._versions.get(event_id)
+            if current is None or current[0] != version:
+                continue
+            current[1] -= 1
+            if current[1] == 0:
+                # Последнее напоминание события: версия больше не нужна
+                del self._versions[event_id]
+
+            task = asyncio.create_task(self._fire(event_id, offset, skipped))
+            self._fire_tasks.add(task)
+            task.add_done_callback(self._fire_tasks.discard)
+
+    async def _fire(self, event_id: str, offset: int, skipped: tuple = ()):
+        """
+        Отправляет напоминание со смещением offset (None - только пометить skipped)
+        и отмечает в событии offset и skipped как отправленные.
+
+        Отметка ставится, только когда напоминание дошло до всех активных участников
+        (заблокировавшие бота не в счет). Не получившим его из-за ошибки Telegram отправка
+        повторяется REMINDER_SEND_ATTEMPTS раз; если и это не помогло, а также при остановке
+        бота напоминание остается неотмеченным и будет отправлено после перезапуска.
+        """
+        try:
+            event = await EventCRUD.get(event_id)
+            if not event:
+                return
+
+            left = event["datetime"] - datetime.utcnow()
+            if offset is None or left.total_seconds() <= 0:
+                await EventCRUD.mark_reminders_sent(event_id, [o for o in (offset, *skipped) if o is not None])
+                return
+
+            # Текст - по реальному остатку времени: догоняющее напоминание уходит позже номинального
+            formatted_datetime = format_event_datetime(event.get("datetime"))
+            text = (
+                f"🔔 Напоминание: событие '{event.get('game', 'Без названия')}' начнется через "
+                f"{_format_time_left(left)} ({formatted_datetime})"
+            )
+            pending = await UserCRUD.filter_active(event.get("participants", []))
+            for attempt in range(Config.REMINDER_SEND_ATTEMPTS):
+                if attempt:
+                    await asyncio.sleep(Config.REMINDER_RETRY_DELAY)
+                pending = [user_id for user_id in pending if not await self._send(user_id, text)]
+                if not pending:
+                    break
+            if pending:
+                logger.warning("Напоминание о событии %s (%s мин.) не доставлено %s участникам, не отмечаем",
+                               event_id, offset, len(pending))
+                return
+
+            await EventCRUD.mark_reminders_sent(event_id, [offset, *skipped])
+        except Exception as e:
+            logger.error("Ошибка при отправке напоминаний о событии %s: %s", event_id, e)
+
+    async def _send(self, user_id: int, text: str) -> bool:
+        """
+        Отправляет напоминание участнику. False - не доставлено, отправку стоит повторить.
+        """
+        try:
+            await self._app.bot.send_message(chat_id=user_id, text=text, rate_limit_args=REMINDER_LIMIT_ARGS)
+            return True
+        except Exception as e:
+            return await handle_send_error(e, user_id, "напоминания")
+
+
+reminder_scheduler = ReminderScheduler()
+EventCRUD.add_listener(reminder_scheduler)
@@ -0,0 +1,121 @@
+"""
+Маршрутизатор callback-запросов.
+
+Вместо цепочки CallbackQueryHandler с регулярными выражениями, которую PTB проверяет
+для каждого нажатия по порядку, регистрируется один обработчик. Он один раз определяет
+ключ маршрута по callback_data (действие кодека или статичная строка) и находит
+функцию по словарю.
+
+ConversationHandler'ы продолжают обрабатывать свои шаги сами, но проверяют
+callback_data через router.matches(...), используя тот же кэшированный разбор.
+"""
+import functools
+import logging
+import time
+
+from telegram import Update
+from telegram.ext import CallbackQueryHandler, ContextTypes
+
+from utils import callback_codec
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=4096)
+def route_key(data) -> str:
+    """
+    Ключ маршрута: действие для закодированных данных, иначе сама строка.
+    """
+    try:
+        return callback_codec.decode(data)[0]
+    except callback_codec.CallbackDataError:
+        return data if isinstance(data, str) else ""
+
+
+class CallbackRouter:
+    """
+    Диспетчер callback-запросов по словарю {ключ: обработчик}.
+
+    Ключ - действие кодека ("join", "rate", ...) или статичная callback_data
+    ("do_not_cancel_event"). Для семейств статичных строк ("filter_today",
+    "filter_week", ...) можно зарегистрировать префикс до первого "_".
+    Для каждого ключа копится число вызовов, суммарное и максимальное время обработки.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._prefixes = {}
+        self._stats = {}  # ключ -> [вызовов, суммарное время, максимальное время]
+
+    def add(self, key: str, callback):
+        self._routes[key] = callback
+
+    def add_prefix(self, prefix: str, callback):
+        self._prefixes[prefix] = callback
+
+    def resolve(self, data):
+        """
+        Возвращает (ключ, обработчик) для callback_data или (ключ, None).
+        """
+        key = route_key(data)
+        callback = self._routes.get(key)
+        if callback is None:
+            prefix = key.split("_", 1)[0]
+            callback = self._prefixes.get(prefix)
+            if callback is not None:
+                key = prefix
+        return key, callback
+
+    @staticmethod
+    def matches(*keys):
+        """
+        Паттерн для CallbackQueryHandler внутри ConversationHandler:
+        срабатывает, если ключ маршрута входит в keys.
+        """
+        wanted = frozenset(keys)
+
+        def check(data) -> bool:
+            return route_key(data) in wanted
+
+        return check
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        key, callback = self.resolve(update.callback_query.data)
+        if callback is None:
+            # Кнопки-заглушки ("ignore") и устаревшие кнопки: просто гасим "часики"
+            await update.callback_query.answer()
+            return
+
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self._stats.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def stats(self) -> dict:
+        """
+        Статистика времени обработки по ключам: {ключ: {"count", "avg_ms", "max_ms"}}.
+        """
+        return {
+            key: {"count": count, "avg_ms": total / count * 1000, "max_ms": peak * 1000}
+            for key, (count, total, peak) in self._stats.items()
+        }
+
+    def log_stats(self):
+        for key, stats in sorted(self.stats().items(), key=lambda item: -item[1]["count"]):
+            logger.info("callback %s: %s вызовов, в среднем %.1f мс, максимум %.1f мс",
+                        key, stats["count"], stats["avg_ms"], stats["max_ms"])
+
+    def handler(self) -> CallbackQueryHandler:
+        """
+        Единственный CallbackQueryHandler маршрутизатора. Регистрируется после
+        ConversationHandler'ов, чтобы шаги диалогов обрабатывались ими.
+        """
+        return CallbackQueryHandler(self.dispatch)
+
+
+router = CallbackRouter()
@@ -1,96 +1,159 @@
+import asyncio
+import functools
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from bson import ObjectId
 from datetime import datetime, timedelta
 from telegram.ext import Application
-from bson import ObjectId
-from database.crud import EventCRUD, UserCRUD  # Импортируем EventCRUD и UserCRUD
-
-
-async def check_upcoming_events(app: Application):
-    now = datetime.utcnow()
-    upcoming = EventCRUD.events_collection.find(
-        {  # Используем коллекцию напрямую, так как EventCRUD.find() не существует
-            "datetime": {
-                "$gte": now.isoformat(),  # Ищем события, которые начнутся в ближайшие 30 минут
-                "$lte": (now + timedelta(minutes=30)).isoformat()
-            },
-            "notified_upcoming": {"$ne": True}  # Добавляем флаг, чтобы не отправлять уведомление повторно
-        })
-
-    async for event in upcoming:
-        participants = event.get("participants", [])
-        for user_id in participants:
-            try:
-                await app.bot.send_message(
-                    chat_id=user_id,
-                    text=f"🔔 Напоминание: скоро начнется событие '{event['game']}' в {event['datetime']}"
-                )
-                # Помечаем событие как уведомленное
-                await EventCRUD.events_collection.update_one(
-                    {"_id": event["_id"]},
-                    {"$set": {"notified_upcoming": True}}
-                )
-            except Exception as e:
-                print(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
+from config import Config
+from database.crud import EventCRUD, UserCRUD  # Импортируем EventCRUD
+from keyboards.builder import KeyboardBuilder
+from utils.outbound import BROADCAST_LIMIT_ARGS, handle_send_error
 
 
 async def check_ended_events_for_rating(app: Application):
     now = datetime.utcnow()
-    # Ищем события, которые закончились в последние 24 часа и по которым еще не запрашивали оценку
-    # Предполагаем, что datetime и duration хранятся в формате, позволяющем их сравнивать
-    # Если datetime - строка ISO, а duration - int часов, то нужно преобразовать
+    # Ищем события, которые закончились в последние 24 часа и по которым еще не запрашивали оценку.
+    # Время окончания хранится в поле ends_at, поэтому запрос идет по индексу без разбора дат в Python.
+    ended_events = EventCRUD.iter_ended_for_rating(now - timedelta(hours=24), now)
+
+    processed_ids = []
+    async for event in ended_events:
+        try:
+            # Заблокировавшим бота не пишем
+            participants = await UserCRUD.filter_active(event.get("participants", []))
+            creator_id = event.get("creator_id")
+            event_id = str(event["_id"])
+
+            for participant_id in participants:
+                if participant_id != creator_id:  # Участник не должен оценивать себя
+                    try:
+                        # Отправляем запрос на оценку
+                        await app.bot.send_message(
+                            chat_id=participant_id,
+                            text=f"Событие '{event['game']}' завершилось. Пожалуйста, оцените создателя ({event.get('creator_name', 'Неизвестен')})!",
+                            reply_markup=KeyboardBuilder.build_rating_keyboard(event_id, creator_id),
+                            # Массовая рассылка раз в час: уступает ответам пользователям и напоминаниям
+                            rate_limit_args=BROADCAST_LIMIT_ARGS
+                        )
+                    except Exception as e:
+                        await handle_send_error(e, participant_id, "запроса на оценку")
+
+            processed_ids.append(event["_id"])
+        except Exception as e:
+            print(f"Ошибка при обработке завершившегося события {event.get('_id')}: {e}")
 
-    # Можно искать события, которые начались до текущего момента и закончились недавно
-    # И не были оценены (добавим поле 'rating_requested' в событие)
+    # Помечаем все обработанные события как "оценка запрошена" одним запросом
+    await EventCRUD.mark_rating_requested(processed_ids)
+
+
+def collect_digests(users: list, events: list) -> dict:
+    """
+    Раскладывает новые события по пользователям: user_id -> события игр из подписок,
+    созданные после последней сводки пользователя (время создания - из ObjectId), кроме своих.
+    """
+    digests = {}
+    for user in users:
+        subscriptions = set(user.get("subscriptions", []))
+        since = ObjectId.from_datetime(user["digest_sent_at"])
+        items = [
+            event for event in events
+            if event["_id"] > since and event.get("game") in subscriptions and event.get("creator_id") != user["_id"]
+        ]
+        if items:
+            digests[user["_id"]] = items
+    return digests
+
+
+async def _send_digest(app: Application, user_id: int, events: list, semaphore: asyncio.Semaphore):
+    shown = events[:Config.DIGEST_MAX_EVENTS]
+    text = f"📬 Новые события по вашим подпискам: {len(events)}"
+    if len(events) > len(shown):
+        text += f"\nПоказаны ближайшие {len(shown)}, остальные - в «👀 Активные события»."
+    async with semaphore:
+        try:
+            await app.bot.send_message(
+                chat_id=user_id,
+                text=text,
+                reply_markup=KeyboardBuilder.active_events_list(shown, user_id),
+                rate_limit_args=BROADCAST_LIMIT_ARGS
+            )
+        except Exception as e:
+            await handle_send_error(e, user_id, "сводки")
 
-    # Получаем все события, которые уже начались
-    all_events_cursor = EventCRUD.events_collection.find({
-        "datetime": {"$lte": now.isoformat()},
-        "rating_requested": {"$ne": True}  # Еще не запрашивали оценку
-    })
 
-    async for event in all_events_cursor:
+async def send_digests(app: Application):
+    """
+    Сводка новых событий для пользователей в режиме "дайджест": одно сообщение на пользователя
+    вместо уведомления о каждом событии. Новые события читаются один раз на весь запуск,
+    пользователи - курсором пачками по BROADCAST_BATCH_SIZE.
+    """
+    now = datetime.utcnow()
+    due_before = now - timedelta(hours=Config.DIGEST_INTERVAL_HOURS)
+    # Сводка покрывает события не старше двух интервалов: пропущенные запуски не копят бесконечный список
+    # События общие для всех получателей, поэтому вместо is_member одного пользователя
+    # загружаем participants: active_events_list сам проверяет участие получателя по его user_id
+    projection = dict(EventCRUD.card_projection(), participants=1)
+    events = await EventCRUD.list_created_since(
+        due_before - timedelta(hours=Config.DIGEST_INTERVAL_HOURS), projection
+    )
+    semaphore = asyncio.Semaphore(Config.BROADCAST_CONCURRENCY)
+
+    async def process(batch: list):
+        digests = collect_digests(batch, events)
+        await asyncio.gather(*(_send_digest(app, user_id, items, semaphore) for user_id, items in digests.items()))
+        # Время сводки сдвигается и тем, кому нечего было отправить
+        await UserCRUD.mark_digest_sent([user["_id"] for user in batch], now)
+
+    batch = []
+    try:
+        async for user in UserCRUD.iter_digest_due(due_before):
+            batch.append(user)
+            if len(batch) >= Config.BROADCAST_BATCH_SIZE:
+                await process(batch)
+                batch = []
+        if batch:
+            await process(batch)
+    except Exception as e:
+        print(f"Ошибка при рассылке сводок: {e}")
+
+
+scheduler = AsyncIOScheduler()
+_running_jobs = set()  # Задачи выполняющихся сейчас заданий, их дожидается stop_scheduler
+
+
+def _tracked(job):
+    """
+    Обертка задания: запоминает его задачу, чтобы при остановке дождаться ее завершения.
+    """
+    @functools.wraps(job)
+    async def wrapper(*args):
+        task = asyncio.current_task()
+        _running_jobs.add(task)
         try:
-            event_datetime_str = event.get("datetime")
-            event_duration_hours = event.get("duration")
-
-            if not event_datetime_str or not event_duration_hours:
-                continue  # Пропускаем, если данные неполные
-
-            event_start_dt = datetime.fromisoformat(event_datetime_str)
-            event_end_dt = event_start_dt + timedelta(hours=event_duration_hours)
-
-            # Если событие закончилось и прошло не более 24 часов с момента окончания
-            if event_end_dt <= now and (now - event_end_dt) <= timedelta(hours=24):
-                participants = event.get("participants", [])
-                creator_id = event.get("creator_id")
-                event_id = str(event["_id"])
-
-                for participant_id in participants:
-                    if participant_id != creator_id:  # Участник не должен оценивать себя
-                        try:
-                            # Отправляем запрос на оценку
-                            await app.bot.send_message(
-                                chat_id=participant_id,
-                                text=f"Событие '{event['game']}' завершилось. Пожалуйста, оцените создателя ({event.get('creator_name', 'Неизвестен')})!",
-                                reply_markup=KeyboardBuilder.build_rating_keyboard(event_id, creator_id)
-                                # Новая клавиатура для оценки
-                            )
-                        except Exception as e:
-                            print(f"Ошибка при отправке запроса на оценку пользователю {participant_id}: {e}")
-
-                # Помечаем событие как "оценка запрошена"
-                await EventCRUD.events_collection.update_one(
-                    {"_id": event["_id"]},
-                    {"$set": {"rating_requested": True}}
-                )
+            await job(*args)
+        finally:
+            _running_jobs.discard(task)
 
-        except Exception as e:
-            print(f"Ошибка при обработке завершившегося события {event.get('_id')}: {e}")
+    return wrapper
 
 
 def setup_scheduler(app: Application):
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(check_upcoming_events, 'interval', minutes=5, args=[app])
-    scheduler.add_job(check_ended_events_for_rating, 'interval', hours=1,
+    # Напоминания о предстоящих событиях отправляет utils.reminders.ReminderScheduler
+    scheduler.add_job(_tracked(check_ended_events_for_rating), 'interval', hours=1,
                       args=[app])  # Проверяем завершившиеся события каждый час
-    scheduler.start()
\ No newline at end of file
+    # Сводки новых событий: проверяем чаще интервала, чтобы сводка не опаздывала больше чем на 15 минут
+    scheduler.add_job(_tracked(send_digests), 'interval', minutes=15, args=[app])
+    scheduler.start()
+
+
+async def stop_scheduler():
+    """
+    Останавливает планировщик и прерывает выполняющиеся задания (рассылку сводок,
+    запросы оценок), дожидаясь их завершения. Вызывается из post_stop.
+    """
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+    tasks = list(_running_jobs)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
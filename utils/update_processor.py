@@ -0,0 +1,111 @@
+import asyncio
+import sys
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений с сохранением порядка внутри одного чата.
+
+    Обновления разных чатов обрабатываются одновременно, но не больше
+    max_concurrent_updates за раз. Обновления одного чата (или пользователя, если чата нет)
+    идут строго по очереди, поэтому состояния ConversationHandler и user_data
+    не портятся гонками. Обновление сначала ждет своей очереди в чате и только потом
+    занимает общий слот, так что один активный пользователь не забирает все слоты.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        self._limit = max_concurrent_updates
+        # Базовый семафор process_update не должен быть вторым ограничителем:
+        # общий лимит применяется в do_process_update уже после очереди чата
+        super().__init__(sys.maxsize)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chats = {}  # ключ чата -> [Lock, число обновлений в очереди и в работе]
+        self._pending = 0  # обновления с ключом чата: в очереди чата и в работе
+        self._in_flight = 0
+        self._waiting = 0
+        self._max_waiting = 0
+        self._processed = 0
+        self._busy_seconds = 0.0
+
+    @property
+    def current_concurrent_updates(self) -> int:
+        # Обрабатываются сейчас; ожидающие в очереди чата или слота не считаются
+        return self._in_flight
+
+    @staticmethod
+    def chat_key(update: object):
+        """
+        Ключ сериализации: id чата, иначе id пользователя, иначе None (без ограничений).
+        """
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine):
+        # Вызывается из process_update базового класса (он помечен @final)
+        key = self.chat_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self._pending += 1
+        try:
+            # asyncio.Lock будит ожидающих в порядке очереди - порядок обновлений чата сохраняется
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            self._pending -= 1
+            if entry[1] == 0:
+                del self._chats[key]
+
+    async def _run(self, coroutine):
+        self._waiting += 1
+        self._max_waiting = max(self._max_waiting, self._waiting)
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._in_flight += 1
+        started = time.perf_counter()
+        try:
+            await coroutine
+        finally:
+            self._busy_seconds += time.perf_counter() - started
+            self._in_flight -= 1
+            self._processed += 1
+            self._slots.release()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self) -> dict:
+        """
+        Текущая загрузка: лимит слотов, обрабатывается сейчас, ждут свободного слота
+        (и максимум ожидания), обновлений в очередях чатов, чатов с очередью, всего обработано.
+        """
+        return {
+            "limit": self._limit,
+            "in_flight": self._in_flight,
+            "pending": self._pending,
+            "waiting": self._waiting,
+            "max_waiting": self._max_waiting,
+            "chats": len(self._chats),
+            "processed": self._processed,
+            "busy_seconds": round(self._busy_seconds, 3),
+        }
@@ -0,0 +1,122 @@
+"""
+HTTP-сервер для режима webhook (RUN_MODE=webhook).
+
+Telegram присылает обновления POST-запросом на WEBHOOK_PATH, сервер проверяет секрет
+из заголовка X-Telegram-Bot-Api-Secret-Token и кладет обновление в app.update_queue.
+GET /health отвечает на проверки балансировщика на том же порту.
+
+Локальная проверка без регистрации вебхука (WEBHOOK_URL не задан):
+    RUN_MODE=webhook WEBHOOK_SECRET=test python main.py
+    curl -X POST -H "Content-Type: application/json" \\
+         -H "X-Telegram-Bot-Api-Secret-Token: test" \\
+         -d @update.json http://localhost:8443/telegram
+где update.json - сохраненный JSON объекта Update.
+"""
+import hmac
+import json
+import logging
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from telegram import Update
+from telegram.ext import Application
+
+from config import Config
+from database.crud import EventCRUD
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class TelegramUpdateHandler(tornado.web.RequestHandler):
+    SUPPORTED_METHODS = ("POST",)
+
+    def initialize(self, app: Application, secret: str):
+        self.app = app
+        self.secret = secret.encode()
+
+    async def post(self):
+        token = self.request.headers.get(SECRET_HEADER, "").encode()
+        if not hmac.compare_digest(token, self.secret):
+            self.set_status(403)
+            return
+
+        try:
+            data = json.loads(self.request.body)
+            # Обновление - всегда JSON-объект; списки, строки и числа отклоняем сразу
+            update = Update.de_json(data, self.app.bot) if isinstance(data, dict) else None
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            # AttributeError - объект с полями не той формы, например {"message": 5}
+            logger.warning("Некорректное обновление в вебхуке: %s", e)
+            self.set_status(400)
+            return
+        if update is None:
+            self.set_status(400)
+            return
+
+        await self.app.update_queue.put(update)
+        self.set_status(200)
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    SUPPORTED_METHODS = ("GET",)
+
+    def initialize(self, app: Application):
+        self.app = app
+
+    def get(self):
+        self.set_status(200 if self.app.running else 503)
+        status = {"status": "ok" if self.app.running else "stopped",
+                  "update_queue": self.app.update_queue.qsize()}
+        stats = getattr(self.app.update_processor, "stats", None)
+        if stats:
+            status["updates"] = stats()  # Загрузка PerChatUpdateProcessor
+        stats = getattr(self.app.bot.rate_limiter, "stats", None)
+        if stats:
+            status["outbound"] = stats()  # Очереди PriorityRateLimiter
+        status["event_cache"] = EventCRUD.cache_stats()
+        self.write(status)
+
+
+class WebhookServer:
+    """
+    Tornado-сервер с маршрутами вебхука и /health. При заданном WEBHOOK_URL
+    регистрирует вебхук в Telegram; накопленные обновления не сбрасываются,
+    поэтому переключение из polling в webhook и обратно ничего не теряет.
+    """
+
+    def __init__(self, app: Application):
+        self.app = app
+        self._server = None
+
+    async def start(self):
+        if not Config.WEBHOOK_SECRET:
+            raise RuntimeError("Для режима webhook нужно задать WEBHOOK_SECRET")
+
+        web_app = tornado.web.Application([
+            (Config.WEBHOOK_PATH, TelegramUpdateHandler, {"app": self.app, "secret": Config.WEBHOOK_SECRET}),
+            (r"/health", HealthHandler, {"app": self.app}),
+        ])
+        self._server = HTTPServer(web_app, xheaders=True)
+        self._server.listen(Config.PORT, address=Config.WEBHOOK_LISTEN)
+        logger.info("Вебхук-сервер слушает %s:%s%s", Config.WEBHOOK_LISTEN, Config.PORT, Config.WEBHOOK_PATH)
+
+        if Config.WEBHOOK_URL:
+            await self.app.bot.set_webhook(
+                url=Config.WEBHOOK_URL.rstrip("/") + Config.WEBHOOK_PATH,
+                secret_token=Config.WEBHOOK_SECRET,
+                max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=False,
+            )
+            logger.info("Вебхук зарегистрирован: %s%s", Config.WEBHOOK_URL, Config.WEBHOOK_PATH)
+        else:
+            logger.info("WEBHOOK_URL не задан, вебхук в Telegram не регистрируется")
+
+    async def stop(self):
+        # Вебхук в Telegram не удаляем: обновления копятся до запуска следующего экземпляра
+        if self._server:
+            self._server.stop()
+            await self._server.close_all_connections()
+            self._server = None